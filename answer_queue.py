@@ -0,0 +1,226 @@
+"""
+Write-Behind Answer Queue
+Optional buffering layer for answer saves.
+
+When enabled, each answer POST only appends to a small local SQLite queue
+(WAL mode, ``synchronous=FULL`` so an acknowledged answer survives a power
+loss) and returns. ``synchronous='NORMAL'`` skips that fsync per enqueue at
+the cost of losing the last acknowledged answers on a crash of the machine. A writer thread moves queued
+answers into attempt_answers in group commits of up to ``batch_size`` rows or
+every ``flush_interval_ms``, so the main database sees one write transaction
+per batch instead of one per click.
+
+Queued rows remember the attempt's user, and each batch is applied to the
+shard that user is routed to (see storage.py).
+
+Anything that grades or displays an attempt must call :meth:`flush_attempt`
+first. Only one flusher runs at a time, serialised by a lock file next to the
+queue, which keeps answers for the same question in order across threads and
+processes. A flusher reads its batch, writes it to the shards and then
+deletes exactly the rows it read, so the queue's own write lock is only held
+for that delete and enqueues never wait behind a slow or busy database.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows; flushers are then serialised per process
+    fcntl = None
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL_MS = 50
+DEFAULT_SYNCHRONOUS = 'FULL'
+SYNCHRONOUS_MODES = ('FULL', 'NORMAL')
+BUSY_TIMEOUT_MS = 5000
+
+
+class AnswerQueue:
+    def __init__(self, queue_path: str, router,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval_ms: int = DEFAULT_FLUSH_INTERVAL_MS,
+                 synchronous: str = DEFAULT_SYNCHRONOUS,
+                 logger=None):
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous must be one of {', '.join(SYNCHRONOUS_MODES)}")
+        self.queue_path = queue_path
+        self.router = router
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.synchronous = synchronous
+        self.logger = logger
+
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._since_flush = 0
+
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS pending_answers (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            attempt_id INTEGER NOT NULL,
+            quiz_id TEXT NOT NULL,
+            question_id INTEGER NOT NULL,
+            selected_option_id TEXT,
+            is_correct INTEGER DEFAULT 0,
+            user_id INTEGER
+        )''')
+        # Queue files created before sharding lack the user column
+        if 'user_id' not in {row[1] for row in conn.execute('PRAGMA table_info(pending_answers)')}:
+            conn.execute('ALTER TABLE pending_answers ADD COLUMN user_id INTEGER')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_pending_answers_attempt
+            ON pending_answers (attempt_id, question_id, seq)''')
+
+    def _conn(self) -> sqlite3.Connection:
+        """One autocommit connection to the queue per thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.queue_path, isolation_level=None,
+                                   timeout=BUSY_TIMEOUT_MS / 1000.0)
+            conn.execute(f'PRAGMA synchronous={self.synchronous}')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, attempt_id: int, user_id: int, quiz_id: str, question_id: int,
+                selected_option_id: Optional[str], is_correct: int) -> None:
+        """Record an answer; it reaches attempt_answers on the next flush."""
+        self._conn().execute('''
+            INSERT INTO pending_answers (attempt_id, user_id, quiz_id, question_id, selected_option_id, is_correct)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (attempt_id, user_id, quiz_id, question_id, selected_option_id, is_correct))
+        self._ensure_writer()
+        self._since_flush += 1
+        if self._since_flush >= self.batch_size:
+            self._wake.set()
+
+    def pending_answer(self, attempt_id: int, question_id: int) -> Optional[Tuple[Optional[str], int]]:
+        """Latest not-yet-flushed answer for a question, if any."""
+        row = self._conn().execute('''
+            SELECT selected_option_id, is_correct FROM pending_answers
+            WHERE attempt_id = ? AND question_id = ?
+            ORDER BY seq DESC
+            LIMIT 1
+        ''', (attempt_id, question_id)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    @contextmanager
+    def _single_flusher(self):
+        """Hold the flusher lock: a thread lock plus an flock on ``<queue>.lock``."""
+        with self._flush_lock:
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(self.queue_path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def _apply(self, where: str, params: tuple) -> int:
+        """Move one batch of matching queue rows into attempt_answers."""
+        queue = self._conn()
+        with self._single_flusher():
+            # A plain read; new answers keep landing behind this batch
+            rows = queue.execute(f'''
+                SELECT seq, attempt_id, user_id, quiz_id, question_id, selected_option_id, is_correct
+                FROM pending_answers
+                WHERE {where}
+                ORDER BY seq
+                LIMIT ?
+            ''', (*params, self.batch_size)).fetchall()
+            if not rows:
+                return 0
+
+            # Only the newest answer per question matters, grouped by shard
+            by_shard: Dict[int, Dict[Tuple[int, int], tuple]] = {}
+            for seq, attempt_id, user_id, quiz_id, question_id, selected, is_correct in rows:
+                latest = by_shard.setdefault(self.router.shard_for_user(user_id), {})
+                latest[(attempt_id, question_id)] = (attempt_id, quiz_id, question_id, selected, is_correct)
+
+            # On failure the rows stay queued and the next flush re-applies them
+            for shard, latest in by_shard.items():
+                self._write(shard, latest.values())
+
+            seqs = [row[0] for row in rows]
+            queue.execute(f'''
+                DELETE FROM pending_answers WHERE seq IN ({', '.join('?' for _ in seqs)})
+            ''', seqs)
+            return len(rows)
+
+    def _write(self, shard: int, answers) -> None:
+        """Apply the newest answers of a batch to one shard in a single commit.
+
+        Answers to attempts that were submitted or expired in the meantime are
+        dropped: the route checks ``completed_at`` before enqueueing, but the
+        attempt can complete before the answer is flushed.
+        """
+        answers = list(answers)
+        conn = self.router.connect_shard(shard)
+        try:
+            conn.executemany('''
+                UPDATE attempt_answers
+                SET selected_option_id = ?, is_correct = ?
+                WHERE attempt_id = ? AND question_id = ?
+                  AND attempt_id IN (SELECT id FROM attempts WHERE completed_at IS NULL)
+            ''', [(selected, is_correct, attempt_id, question_id)
+                  for attempt_id, _, question_id, selected, is_correct in answers])
+            conn.executemany('''
+                INSERT INTO attempt_answers (attempt_id, quiz_id, question_id, selected_option_id, is_correct)
+                SELECT ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM attempt_answers WHERE attempt_id = ? AND question_id = ?
+                )
+                  AND EXISTS (SELECT 1 FROM attempts WHERE id = ? AND completed_at IS NULL)
+            ''', [(*values, values[0], values[2], values[0]) for values in answers])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def flush_attempt(self, attempt_id: int) -> int:
+        """Apply every queued answer of one attempt; returns rows flushed."""
+        flushed = 0
+        while True:
+            applied = self._apply('attempt_id = ?', (attempt_id,))
+            flushed += applied
+            if applied < self.batch_size:
+                return flushed
+
+    def flush(self) -> int:
+        """Drain the whole queue in group commits; returns rows flushed."""
+        self._since_flush = 0
+        if not self._conn().execute('SELECT 1 FROM pending_answers LIMIT 1').fetchone():
+            return 0
+        flushed = 0
+        while True:
+            applied = self._apply('1 = 1', ())
+            flushed += applied
+            if applied < self.batch_size:
+                return flushed
+
+    def _ensure_writer(self) -> None:
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name='answer-queue-writer',
+                                                daemon=True)
+                self._writer.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                if self.logger:
+                    self.logger.exception('Answer queue flush failed')
@@ -0,0 +1,166 @@
+"""
+Answer Store Module
+Compact storage for the answers of completed attempts.
+
+Live attempts write one attempt_answers row per question. Once an attempt is
+archived its rows are folded into a single attempt_answer_packs row:
+
+* ``selected`` - one byte per question id (byte ``i`` is question ``i + 1``),
+  holding the option index (``'a'`` = 1, ``'b'`` = 2, ...) or 0 if unanswered.
+* ``correct`` - a bitmap with bit ``i`` set when question ``i + 1`` was
+  graded correct at answer time.
+
+Readers go through :func:`load_attempt_answers`, which understands both forms.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Largest question id a pack can hold; attempts beyond it stay as rows
+MAX_PACKED_QUESTION_ID = 4096
+DEFAULT_BATCH_SIZE = 500
+
+Answer = Tuple[Optional[str], int]
+
+
+def _option_code(option_id: Optional[str]) -> Optional[int]:
+    """Map option ids 'a'..'z' to 1..26; None for anything that can't be packed."""
+    if option_id is None:
+        return 0
+    if len(option_id) == 1 and 'a' <= option_id <= 'z':
+        return ord(option_id) - ord('a') + 1
+    return None
+
+
+def pack_answers(answers: Dict[int, Answer]) -> Optional[Tuple[bytes, bytes]]:
+    """Encode {question_id: (selected_option_id, is_correct)} as (selected, correct) blobs.
+
+    Returns None when the answers use ids that don't fit the packed layout.
+    """
+    size = max(answers, default=0)
+    if size > MAX_PACKED_QUESTION_ID or any(qid < 1 for qid in answers):
+        return None
+
+    selected = bytearray(size)
+    correct = bytearray((size + 7) // 8)
+    for question_id, (option_id, is_correct) in answers.items():
+        code = _option_code(option_id)
+        if code is None:
+            return None
+        index = question_id - 1
+        selected[index] = code
+        if code and is_correct:
+            correct[index >> 3] |= 1 << (index & 7)
+    return bytes(selected), bytes(correct)
+
+
+def unpack_answers(selected: bytes, correct: bytes) -> Dict[int, Answer]:
+    """Decode a packed row back into {question_id: (selected_option_id, is_correct)}."""
+    answers = {}
+    for index, code in enumerate(selected):
+        if code:
+            is_correct = 1 if correct[index >> 3] & (1 << (index & 7)) else 0
+            answers[index + 1] = (chr(ord('a') + code - 1), is_correct)
+    return answers
+
+
+def load_attempt_answers(c, attempt_id: int) -> Dict[int, Answer]:
+    """Return all answers of an attempt, whichever format they are stored in.
+
+    Row answers win over a pack so late writes to an archived attempt still show.
+    """
+    c.execute('SELECT selected, correct FROM attempt_answer_packs WHERE attempt_id = ?',
+              (attempt_id,))
+    pack = c.fetchone()
+    answers = unpack_answers(pack['selected'], pack['correct']) if pack else {}
+
+    c.execute('''
+        SELECT question_id, selected_option_id, is_correct FROM attempt_answers
+        WHERE attempt_id = ?
+    ''', (attempt_id,))
+    for row in c.fetchall():
+        answers[row['question_id']] = (row['selected_option_id'], row['is_correct'])
+    return answers
+
+
+def load_packed_answers(conn, attempt_ids: Iterable[int]) -> Dict[int, Dict[int, Answer]]:
+    """Bulk variant of the pack lookup for batch jobs: {attempt_id: answers}."""
+    attempt_ids = list(attempt_ids)
+    if not attempt_ids:
+        return {}
+    placeholders = ', '.join('?' for _ in attempt_ids)
+    rows = conn.execute(f'''
+        SELECT attempt_id, selected, correct FROM attempt_answer_packs
+        WHERE attempt_id IN ({placeholders})
+    ''', attempt_ids).fetchall()
+    return {row[0]: unpack_answers(row[1], row[2]) for row in rows}
+
+
+def _database_bytes(conn) -> int:
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return page_count * page_size
+
+
+def compact_attempts(conn, older_than_days: int = 30,
+                     batch_size: int = DEFAULT_BATCH_SIZE,
+                     vacuum: bool = False) -> Dict[str, int]:
+    """Fold the answer rows of completed attempts older than the cut-off into packs.
+
+    Works in batches of ``batch_size`` attempts, one transaction each.
+    Returns counts of packed attempts, removed rows, skipped attempts and the
+    database size before and after (only shrinks on disk with ``vacuum``).
+    """
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    summary = {'attempts': 0, 'rows': 0, 'skipped': 0,
+               'bytes_before': _database_bytes(conn)}
+    last_id = 0
+
+    while True:
+        attempt_ids = [row[0] for row in conn.execute('''
+            SELECT id FROM attempts
+            WHERE id > ? AND completed_at IS NOT NULL AND completed_at < ?
+              AND EXISTS (SELECT 1 FROM attempt_answers aa WHERE aa.attempt_id = attempts.id)
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, cutoff, batch_size)).fetchall()]
+        if not attempt_ids:
+            break
+        last_id = attempt_ids[-1]
+
+        grouped: Dict[int, Dict[int, Answer]] = load_packed_answers(conn, attempt_ids)
+        placeholders = ', '.join('?' for _ in attempt_ids)
+        rows = conn.execute(f'''
+            SELECT attempt_id, question_id, selected_option_id, is_correct
+            FROM attempt_answers
+            WHERE attempt_id IN ({placeholders})
+        ''', attempt_ids).fetchall()
+        for attempt_id, question_id, option_id, is_correct in rows:
+            grouped.setdefault(attempt_id, {})[question_id] = (option_id, is_correct)
+
+        packs: List[tuple] = []
+        for attempt_id in attempt_ids:
+            packed = pack_answers(grouped.get(attempt_id, {}))
+            if packed is None:
+                summary['skipped'] += 1
+                continue
+            packs.append((attempt_id, *packed))
+
+        if packs:
+            conn.executemany('''
+                INSERT OR REPLACE INTO attempt_answer_packs (attempt_id, selected, correct)
+                VALUES (?, ?, ?)
+            ''', packs)
+            packed_ids = [pack[0] for pack in packs]
+            deleted = conn.execute(f'''
+                DELETE FROM attempt_answers
+                WHERE attempt_id IN ({', '.join('?' for _ in packed_ids)})
+            ''', packed_ids).rowcount
+            summary['attempts'] += len(packs)
+            summary['rows'] += deleted
+        conn.commit()
+
+    if vacuum:
+        conn.execute('VACUUM')
+    summary['bytes_after'] = _database_bytes(conn)
+    return summary
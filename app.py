@@ -1,7 +1,8 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, stream_with_context, get_flashed_messages
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
+import click
 import sqlite3
 import os
 import random
@@ -22,6 +23,49 @@ from data_loader import (
     get_randomized_quiz_by_id,
     shuffle_options,
 )
+from item_analysis import (
+    DEFAULT_CHUNK_SIZE,
+    refresh_question_stats,
+    get_flagged_questions,
+)
+from leaderboard import (
+    GLOBAL_SCOPE,
+    LEADERBOARD_SIZE,
+    DURATION_SQL,
+    record_score,
+    get_leaderboard,
+    rebuild_leaderboards,
+)
+from data_export import (
+    DATASETS,
+    FORMATS,
+    stream_export,
+    export_filename,
+    import_file,
+)
+from answer_store import load_attempt_answers, compact_attempts
+from attempt_expiry import (
+    attempt_deadline,
+    is_past_deadline,
+    expire_attempts,
+    start_sweeper,
+)
+from assets import init_assets, build_assets
+from compression import init_compression
+from answer_queue import AnswerQueue
+from mistake_index import (
+    REVIEW_BATCH_SIZE,
+    record_attempt_mistakes,
+    record_review,
+    get_due_reviews,
+    get_review_summary,
+    get_mistake,
+    forget_mistake,
+)
+from regrade import DEFAULT_BATCH_SIZE as REGRADE_BATCH_SIZE, regrade_all
+from attempt_history import PAGE_SIZE as HISTORY_PAGE_SIZE, backfill_sort_keys, get_history_page
+from near_duplicates import DEFAULT_THRESHOLD as DUPLICATE_THRESHOLD, find_near_duplicates
+from storage import DEFAULT_COPY_BATCH_SIZE as RESHARD_BATCH_SIZE, ShardRouter, close_all, reshard
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,6 +73,27 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
 app.config['DATABASE'] = os.getenv('DATABASE', 'codemcq.db')
+# Comma-separated list of emails allowed to use the admin export endpoints
+app.config['ADMIN_EMAILS'] = {
+    email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()
+}
+# Seconds between in-process expiry sweeps when running app.py directly (0 = off)
+app.config['EXPIRY_SWEEP_INTERVAL'] = int(os.getenv('EXPIRY_SWEEP_INTERVAL', '0'))
+
+# Serve fingerprinted bundles from static/dist when `flask build-assets` has run
+init_assets(app)
+# Gzip HTML and JSON responses, including streamed ones
+init_compression(app)
+
+# Optional write-behind queue for answer saves (unset = write straight to the DB)
+app.config['ANSWER_QUEUE_PATH'] = os.getenv('ANSWER_QUEUE_PATH')
+app.config['ANSWER_QUEUE_BATCH_SIZE'] = int(os.getenv('ANSWER_QUEUE_BATCH_SIZE', '100'))
+app.config['ANSWER_QUEUE_FLUSH_MS'] = int(os.getenv('ANSWER_QUEUE_FLUSH_MS', '50'))
+# NORMAL skips the fsync per enqueue; acknowledged answers can then be lost on power loss
+app.config['ANSWER_QUEUE_SYNCHRONOUS'] = os.getenv('ANSWER_QUEUE_SYNCHRONOUS', 'FULL')
+
+# Rendered template output is sent in chunks of at least this many Jinja events
+STREAM_BUFFER_SIZE = 100
 
 
 @app.context_processor
@@ -38,12 +103,17 @@ def inject_language_labels():
         'get_language_label': get_language_label
     }
 
+def add_column_if_missing(c, table, column, definition):
+    """Add a column to an existing table created by an older init_db; True if it was added"""
+    c.execute(f'PRAGMA table_info({table})')
+    if column in {row[1] for row in c.fetchall()}:
+        return False
+    c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return True
+
 # Initialize database
-def init_db():
-    """Initialize the database with required tables"""
-    conn = sqlite3.connect(app.config['DATABASE'])
-    c = conn.cursor()
-    
+def init_main_schema(c):
+    """Tables shared by all users, kept in the main database"""
     # Users table
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -53,6 +123,56 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
     
+    # Cached per-question item analysis (see item_analysis.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS question_stats (
+        quiz_id TEXT NOT NULL,
+        question_id INTEGER NOT NULL,
+        responses INTEGER DEFAULT 0,
+        correct INTEGER DEFAULT 0,
+        sum_score REAL DEFAULT 0,
+        sum_score_sq REAL DEFAULT 0,
+        sum_correct_score REAL DEFAULT 0,
+        option_counts TEXT,
+        p_value REAL,
+        point_biserial REAL,
+        updated_at TIMESTAMP,
+        PRIMARY KEY (quiz_id, question_id)
+    )''')
+    
+    # Progress markers for incremental background jobs
+    c.execute('''CREATE TABLE IF NOT EXISTS job_watermarks (
+        job TEXT PRIMARY KEY,
+        last_completed_at TIMESTAMP,
+        last_attempt_id INTEGER,
+        updated_at TIMESTAMP
+    )''')
+    
+    # Answer key of each bank as of the last re-grade (see regrade.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS bank_answer_keys (
+        quiz_id TEXT PRIMARY KEY,
+        key_hash TEXT NOT NULL,
+        answer_key TEXT NOT NULL,
+        updated_at TIMESTAMP
+    )''')
+    
+    # MinHash signatures of every bank's questions (see near_duplicates.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS bank_signatures (
+        quiz_id TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        question_ids TEXT NOT NULL,
+        signatures BLOB NOT NULL,
+        updated_at TIMESTAMP
+    )''')
+    
+    # Shard files and their id ranges; empty while the main database is the only shard
+    c.execute('''CREATE TABLE IF NOT EXISTS shards (
+        shard_index INTEGER PRIMARY KEY,
+        path TEXT NOT NULL,
+        id_base INTEGER NOT NULL
+    )''')
+
+def init_shard_schema(c):
+    """Per-user tables, created in every shard (see storage.py)"""
     # Attempts table
     c.execute('''CREATE TABLE IF NOT EXISTS attempts (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -88,14 +208,111 @@ def init_db():
         FOREIGN KEY (user_id) REFERENCES users (id)
     )''')
     
+    # Deadline of an open attempt, swept by attempt_expiry.py
+    add_column_if_missing(c, 'attempts', 'expires_at', 'TIMESTAMP')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_attempts_open_expiry
+        ON attempts (expires_at) WHERE completed_at IS NULL''')
+    
+    # History sort key: completion time, or start time while the attempt is open
+    if add_column_if_missing(c, 'attempts', 'sort_at', 'TIMESTAMP'):
+        c.execute('UPDATE attempts SET sort_at = COALESCE(completed_at, started_at)')
+    # Covering indexes for paginated history (see attempt_history.py)
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_attempts_history
+        ON attempts (user_id, sort_at, id, quiz_id, score, total_correct, total_wrong,
+                     total_unanswered, completed_at)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_attempts_history_quiz
+        ON attempts (user_id, quiz_id, sort_at, id, score, total_correct, total_wrong,
+                     total_unanswered, completed_at)''')
+    
+    # Indexes for answer lookups and completed-attempt scans
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_attempt_answers_attempt
+        ON attempt_answers (attempt_id, question_id)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_attempts_completed
+        ON attempts (completed_at, id)''')
+    
+    # Bounded top-K leaderboards, one best entry per user per scope
+    c.execute('''CREATE TABLE IF NOT EXISTS leaderboard_entries (
+        scope TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        attempt_id INTEGER NOT NULL,
+        quiz_id TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        duration_seconds REAL NOT NULL,
+        completed_at TIMESTAMP,
+        PRIMARY KEY (scope, user_id)
+    )''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_leaderboard_rank
+        ON leaderboard_entries (scope, score DESC, duration_seconds, completed_at, attempt_id)''')
+    
+    # Archived answers, one packed row per completed attempt (see answer_store.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS attempt_answer_packs (
+        attempt_id INTEGER PRIMARY KEY,
+        selected BLOB NOT NULL,
+        correct BLOB NOT NULL,
+        FOREIGN KEY (attempt_id) REFERENCES attempts (id)
+    )''')
+    
+    # Per-user missed questions for review mode (see mistake_index.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS user_mistakes (
+        user_id INTEGER NOT NULL,
+        quiz_id TEXT NOT NULL,
+        question_id INTEGER NOT NULL,
+        last_wrong_at TIMESTAMP NOT NULL,
+        wrong_count INTEGER DEFAULT 1,
+        streak INTEGER DEFAULT 0,
+        due_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, quiz_id, question_id),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_user_mistakes_due
+        ON user_mistakes (user_id, due_at)''')
+    
+    # New ids given to imported rows whose original id was taken (see data_export.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS imported_ids (
+        dataset TEXT NOT NULL,
+        source_id INTEGER NOT NULL,
+        target_id INTEGER NOT NULL,
+        PRIMARY KEY (dataset, source_id)
+    )''')
+
+def init_db():
+    """Initialize the main database and every shard with required tables"""
+    conn = sqlite3.connect(router.main_path)
+    init_main_schema(conn.cursor())
     conn.commit()
     conn.close()
+    router.reload()
+    router.init_shards(init_shard_schema)
+
+# Routes attempts, answers and submissions to the user's shard (see storage.py)
+router = ShardRouter(lambda: app.config['DATABASE'])
 
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(app.config['DATABASE'])
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get a connection to the main database (users and shared tables)"""
+    return router.connect_main()
+
+def get_user_db(user_id=None):
+    """Get a connection to the shard holding a user's data (default: the logged-in user)"""
+    return router.connect_for_user(session['user_id'] if user_id is None else user_id)
+
+
+# Created on import so every worker process drains the same queue file
+answer_queue = None
+if app.config['ANSWER_QUEUE_PATH']:
+    answer_queue = AnswerQueue(app.config['ANSWER_QUEUE_PATH'], router,
+                               batch_size=app.config['ANSWER_QUEUE_BATCH_SIZE'],
+                               flush_interval_ms=app.config['ANSWER_QUEUE_FLUSH_MS'],
+                               synchronous=app.config['ANSWER_QUEUE_SYNCHRONOUS'],
+                               logger=app.logger)
+
+
+def flush_pending_answers(attempt_id=None):
+    """Push queued answers into attempt_answers before they are read"""
+    if answer_queue is None:
+        return 0
+    if attempt_id is None:
+        return answer_queue.flush()
+    return answer_queue.flush_attempt(attempt_id)
 
 
 def set_user_session(user):
@@ -105,6 +322,16 @@ def set_user_session(user):
     session['user_email'] = user['email']
 
 
+def stream_page(template_name, **context):
+    """Render a template as a streamed response instead of one big string"""
+    # The session cookie goes out with the headers, so pop flashes before streaming
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+
 def parse_db_timestamp(value):
     """Best-effort conversion from SQLite stored timestamp to datetime"""
     if not value:
@@ -136,6 +363,19 @@ def require_login(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+def require_admin(f):
+    """Decorator to require an admin account (see ADMIN_EMAILS)"""
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Please login to access this page.', 'error')
+            return redirect(url_for('login'))
+        if session.get('user_email', '').lower() not in app.config['ADMIN_EMAILS']:
+            flash('Admin access required.', 'error')
+            return redirect(url_for('dashboard'))
+        return f(*args, **kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
 # Routes
 @app.route('/')
 def index():
@@ -236,7 +476,7 @@ def logout():
 @require_login
 def dashboard():
     """User dashboard"""
-    conn = get_db()
+    conn = get_user_db()
     c = conn.cursor()
     
     # Get user stats
@@ -250,15 +490,8 @@ def dashboard():
     ''', (session['user_id'],))
     stats = c.fetchone()
     
-    # Get recent attempts
-    c.execute('''
-        SELECT a.*
-        FROM attempts a
-        WHERE a.user_id = ?
-        ORDER BY COALESCE(a.completed_at, a.started_at) DESC
-        LIMIT 5
-    ''', (session['user_id'],))
-    recent_attempts = c.fetchall()
+    # Get recent attempts (first page of the history index)
+    recent_attempts, _ = get_history_page(c, session['user_id'], limit=5)
     
     conn.close()
     
@@ -269,9 +502,8 @@ def dashboard():
     # Update recent attempts with proper titles
     attempts_list = []
     for attempt in recent_attempts:
-        attempt_dict = dict(attempt)
-        attempt_dict['quiz_title'] = quiz_titles.get(attempt_dict['quiz_id'], attempt_dict['quiz_id'])
-        attempts_list.append(attempt_dict)
+        attempt['quiz_title'] = quiz_titles.get(attempt['quiz_id'], attempt['quiz_id'])
+        attempts_list.append(attempt)
     
     return render_template('dashboard.html',
                          stats=stats,
@@ -343,7 +575,7 @@ def quiz_start(language, level):
         flash('Invalid quiz configuration.', 'error')
         return redirect(url_for('quiz_select'))
     
-    conn = get_db()
+    conn = get_user_db()
     c = conn.cursor()
     
     # Create new attempt with randomized questions
@@ -351,10 +583,11 @@ def quiz_start(language, level):
     session[f'quiz_attempt_questions_{quiz_id}'] = quiz.get('questions', [])
     
     # Create new attempt record
+    started_at = datetime.now()
     c.execute('''
-        INSERT INTO attempts (user_id, quiz_id, started_at)
-        VALUES (?, ?, ?)
-    ''', (session['user_id'], quiz_id, datetime.now()))
+        INSERT INTO attempts (user_id, quiz_id, started_at, expires_at, sort_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (session['user_id'], quiz_id, started_at, attempt_deadline(started_at, quiz), started_at))
     attempt_id = c.lastrowid
     conn.commit()
     conn.close()
@@ -365,7 +598,7 @@ def quiz_start(language, level):
 @require_login
 def quiz_question(attempt_id, q_no):
     """Display and handle quiz question with randomized options"""
-    conn = get_db()
+    conn = get_user_db()
     c = conn.cursor()
     
     # Verify attempt belongs to user
@@ -413,14 +646,20 @@ def quiz_question(attempt_id, q_no):
     
     # Handle POST (save answer)
     if request.method == 'POST':
-        selected_option = request.form.get('option')
+        # Answers are only accepted while the attempt is open and on time
+        if attempt['completed_at']:
+            conn.close()
+            flash('This quiz has already been submitted.', 'error')
+            return redirect(url_for('result', attempt_id=attempt_id))
+        deadline = parse_db_timestamp(attempt['expires_at'])
+        if deadline is None:
+            deadline = attempt_deadline(parse_db_timestamp(attempt['started_at']), quiz_orig)
+        if is_past_deadline(deadline):
+            conn.close()
+            flash('Time is up! Your answer was not saved.', 'error')
+            return redirect(url_for('quiz_submit', attempt_id=attempt_id))
         
-        # Check if answer already exists
-        c.execute('''
-            SELECT id FROM attempt_answers
-            WHERE attempt_id = ? AND question_id = ?
-        ''', (attempt_id, question['id']))
-        existing = c.fetchone()
+        selected_option = request.form.get('option')
         
         # Find correct option
         correct_option = None
@@ -431,21 +670,32 @@ def quiz_question(attempt_id, q_no):
         
         is_correct = 1 if selected_option == correct_option else 0
         
-        if existing:
-            # Update existing answer
-            c.execute('''
-                UPDATE attempt_answers
-                SET selected_option_id = ?, is_correct = ?
-                WHERE attempt_id = ? AND question_id = ?
-            ''', (selected_option, is_correct, attempt_id, question['id']))
+        if answer_queue is not None:
+            # Acknowledge now, the queue writer group-commits it shortly
+            answer_queue.enqueue(attempt_id, session['user_id'], quiz_identifier, question['id'], selected_option, is_correct)
         else:
-            # Insert new answer
+            # Check if answer already exists
             c.execute('''
-                INSERT INTO attempt_answers (attempt_id, quiz_id, question_id, selected_option_id, is_correct)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (attempt_id, quiz_identifier, question['id'], selected_option, is_correct))
-        
-        conn.commit()
+                SELECT id FROM attempt_answers
+                WHERE attempt_id = ? AND question_id = ?
+            ''', (attempt_id, question['id']))
+            existing = c.fetchone()
+            
+            if existing:
+                # Update existing answer
+                c.execute('''
+                    UPDATE attempt_answers
+                    SET selected_option_id = ?, is_correct = ?
+                    WHERE attempt_id = ? AND question_id = ?
+                ''', (selected_option, is_correct, attempt_id, question['id']))
+            else:
+                # Insert new answer
+                c.execute('''
+                    INSERT INTO attempt_answers (attempt_id, quiz_id, question_id, selected_option_id, is_correct)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (attempt_id, quiz_identifier, question['id'], selected_option, is_correct))
+            
+            conn.commit()
         
         # Redirect to next question or submit
         if q_no + 1 < total_questions:
@@ -455,13 +705,17 @@ def quiz_question(attempt_id, q_no):
             conn.close()
             return redirect(url_for('quiz_submit', attempt_id=attempt_id))
     
-    # Get saved answer for this question
-    c.execute('''
-        SELECT selected_option_id FROM attempt_answers
-        WHERE attempt_id = ? AND question_id = ?
-    ''', (attempt_id, question['id']))
-    saved_answer = c.fetchone()
-    selected_option = saved_answer['selected_option_id'] if saved_answer else None
+    # Get saved answer for this question (a queued answer is the newest)
+    pending = answer_queue.pending_answer(attempt_id, question['id']) if answer_queue else None
+    if pending:
+        selected_option = pending[0]
+    else:
+        c.execute('''
+            SELECT selected_option_id FROM attempt_answers
+            WHERE attempt_id = ? AND question_id = ?
+        ''', (attempt_id, question['id']))
+        saved_answer = c.fetchone()
+        selected_option = saved_answer['selected_option_id'] if saved_answer else None
     
     # Calculate time remaining
     duration = timedelta(minutes=quiz_orig.get('duration_minutes', 15))
@@ -489,7 +743,8 @@ def quiz_question(attempt_id, q_no):
 @require_login
 def quiz_submit(attempt_id):
     """Submit quiz and calculate results"""
-    conn = get_db()
+    flush_pending_answers(attempt_id)
+    conn = get_user_db()
     c = conn.cursor()
     
     # Verify attempt
@@ -524,17 +779,14 @@ def quiz_submit(attempt_id):
     correct = 0
     wrong = 0
     unanswered = 0
+    answers = load_attempt_answers(c, attempt_id)
     
     for question in questions:
-        c.execute('''
-            SELECT selected_option_id, is_correct FROM attempt_answers
-            WHERE attempt_id = ? AND question_id = ?
-        ''', (attempt_id, question['id']))
-        answer = c.fetchone()
+        selected_option_id, is_correct = answers.get(question['id'], (None, 0))
         
-        if not answer or not answer['selected_option_id']:
+        if not selected_option_id:
             unanswered += 1
-        elif answer['is_correct']:
+        elif is_correct:
             correct += 1
         else:
             wrong += 1
@@ -543,13 +795,23 @@ def quiz_submit(attempt_id):
     total_correct = correct
     total_wrong = wrong
     total_unanswered = unanswered
+    completed_at = datetime.now()
     
     # Update attempt
     c.execute('''
         UPDATE attempts
-        SET score = ?, completed_at = ?, total_correct = ?, total_wrong = ?, total_unanswered = ?
+        SET score = ?, completed_at = ?, sort_at = ?, total_correct = ?, total_wrong = ?, total_unanswered = ?
         WHERE id = ?
-    ''', (score, datetime.now(), total_correct, total_wrong, total_unanswered, attempt_id))
+    ''', (score, completed_at, completed_at, total_correct, total_wrong, total_unanswered, attempt_id))
+    
+    # Offer the score to the quiz and global leaderboards in the same transaction;
+    # the duration uses the same definition as a leaderboard rebuild
+    c.execute(f'SELECT COALESCE({DURATION_SQL}, 0) FROM attempts WHERE id = ?', (attempt_id,))
+    duration_seconds = c.fetchone()[0]
+    record_score(c, attempt['user_id'], attempt['quiz_id'], attempt_id, score,
+                 duration_seconds, completed_at)
+    # Misses go to the review index, correct answers advance due reviews
+    record_attempt_mistakes(c, [attempt_id], completed_at)
     
     conn.commit()
     conn.close()
@@ -563,7 +825,8 @@ def quiz_submit(attempt_id):
 @require_login
 def result(attempt_id):
     """Display quiz results"""
-    conn = get_db()
+    flush_pending_answers(attempt_id)
+    conn = get_user_db()
     c = conn.cursor()
     
     # Get attempt
@@ -588,48 +851,257 @@ def result(attempt_id):
         # Fallback: use original questions (session may have expired)
         questions = quiz.get('questions', [])
     
-    # Get all answers
-    results = []
+    # Get all answers (row or packed storage)
+    answers = load_attempt_answers(c, attempt_id)
+    conn.close()
     
-    for question in questions:
-        c.execute('''
-            SELECT selected_option_id, is_correct FROM attempt_answers
-            WHERE attempt_id = ? AND question_id = ?
-        ''', (attempt_id, question['id']))
-        answer = c.fetchone()
-        
-        selected_option_id = answer['selected_option_id'] if answer else None
-        selected_option_text = None
-        correct_option_id = None
-        correct_option_text = None
-        
-        # Find option text for selected and correct answers
-        for opt in question['options']:
-            if opt['id'] == selected_option_id:
-                selected_option_text = opt.get('text', '')
-            if opt['is_correct']:
-                correct_option_id = opt['id']
-                correct_option_text = opt.get('text', '')
-        
-        results.append({
-            'question': question,
-            'selected_option_id': selected_option_id,
-            'selected_option_text': selected_option_text,
-            'correct_option_id': correct_option_id,
-            'correct_option_text': correct_option_text,
-            'is_correct': answer['is_correct'] if answer else False
-        })
+    def iter_results():
+        """Build each question's review row as the template reaches it"""
+        for question in questions:
+            selected_option_id, is_correct = answers.get(question['id'], (None, False))
+            selected_option_text = None
+            correct_option_id = None
+            correct_option_text = None
+            
+            # Find option text for selected and correct answers
+            for opt in question['options']:
+                if opt['id'] == selected_option_id:
+                    selected_option_text = opt.get('text', '')
+                if opt['is_correct']:
+                    correct_option_id = opt['id']
+                    correct_option_text = opt.get('text', '')
+            
+            yield {
+                'question': question,
+                'selected_option_id': selected_option_id,
+                'selected_option_text': selected_option_text,
+                'correct_option_id': correct_option_id,
+                'correct_option_text': correct_option_text,
+                'is_correct': is_correct
+            }
     
+    # Prepare quiz object with randomized questions (read-only, no deep copy needed)
+    quiz_display = dict(quiz, questions=questions)
+    
+    return stream_page('result.html',
+                       attempt=dict(attempt),
+                       quiz=quiz_display,
+                       results=iter_results())
+
+@app.route('/leaderboard')
+@require_login
+def leaderboard():
+    """Global or per-quiz leaderboard"""
+    quiz_catalog = load_quiz_catalog()
+    quiz_titles = {q['id']: q['title'] for q in quiz_catalog}
+    
+    selected_quiz = request.args.get('quiz', '')
+    if selected_quiz not in quiz_titles:
+        selected_quiz = ''
+    
+    # Each shard holds the top entries of its own users; merge them
+    shards = router.connect_all()
+    conn = get_db()
+    entries = get_leaderboard(shards, conn, selected_quiz or GLOBAL_SCOPE)
     conn.close()
+    close_all(shards)
     
-    # Prepare quiz object with randomized questions
-    quiz_display = copy.deepcopy(quiz)
-    quiz_display['questions'] = questions
+    for entry in entries:
+        entry['quiz_title'] = quiz_titles.get(entry['quiz_id'], entry['quiz_id'])
     
-    return render_template('result.html',
-                         attempt=dict(attempt),
-                         quiz=quiz_display,
-                         results=results)
+    return render_template('leaderboard.html',
+                         entries=entries,
+                         quiz_catalog=quiz_catalog,
+                         selected_quiz=selected_quiz,
+                         leaderboard_size=LEADERBOARD_SIZE)
+
+def history_filters():
+    """Read history filters from the query string, dropping unknown quizzes and levels"""
+    quiz_id = request.args.get('quiz', '')
+    if quiz_id not in {q['id'] for q in load_quiz_catalog()}:
+        quiz_id = ''
+    level = request.args.get('level', '').lower()
+    if level not in LEVELS:
+        level = ''
+    return {
+        'quiz_id': quiz_id,
+        'level': level,
+        'since': request.args.get('since', ''),
+        'until': request.args.get('until', ''),
+    }
+
+@app.route('/history')
+@require_login
+def history():
+    """Full attempt history, newest first, one cursor page at a time"""
+    quiz_catalog = load_quiz_catalog()
+    quiz_titles = {q['id']: q['title'] for q in quiz_catalog}
+    filters = history_filters()
+    cursor = request.args.get('cursor') or None
+    
+    conn = get_user_db()
+    c = conn.cursor()
+    try:
+        attempts, next_cursor = get_history_page(c, session['user_id'], cursor=cursor, **filters)
+    except ValueError as e:
+        conn.close()
+        flash(str(e), 'error')
+        return redirect(url_for('history'))
+    conn.close()
+    
+    for attempt in attempts:
+        attempt['quiz_title'] = quiz_titles.get(attempt['quiz_id'], attempt['quiz_id'])
+    
+    return render_template('history.html',
+                         attempts=attempts,
+                         next_cursor=next_cursor,
+                         is_first_page=cursor is None,
+                         filters=filters,
+                         quiz_catalog=quiz_catalog,
+                         levels=LEVELS)
+
+@app.route('/api/history')
+@require_login
+def api_history():
+    """JSON attempt history; pass next_cursor back as ?cursor= for the next page"""
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    conn = get_user_db()
+    c = conn.cursor()
+    try:
+        attempts, next_cursor = get_history_page(c, session['user_id'],
+                                                 cursor=request.args.get('cursor') or None,
+                                                 limit=limit, **history_filters())
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+    conn.close()
+    return jsonify({'attempts': attempts, 'next_cursor': next_cursor})
+
+def find_bank_question(quiz_id, question_id):
+    """Return (quiz, question) for a question id, or (quiz, None) if it is gone"""
+    quiz = get_quiz_by_id(quiz_id)
+    if not quiz:
+        return None, None
+    for question in quiz.get('questions', []):
+        if question['id'] == question_id:
+            return quiz, question
+    return quiz, None
+
+@app.route('/review', methods=['GET', 'POST'])
+@require_login
+def review():
+    """Spaced-repetition review of previously missed questions"""
+    user_id = session['user_id']
+    now = datetime.now()
+    conn = get_user_db()
+    c = conn.cursor()
+
+    if request.method == 'POST':
+        quiz_id = request.form.get('quiz_id', '')
+        question_id = request.form.get('question_id', type=int)
+        selected_option = request.form.get('option')
+        mistake = get_mistake(c, user_id, quiz_id, question_id)
+        quiz, question = find_bank_question(quiz_id, question_id) if mistake else (None, None)
+        if not question or not selected_option:
+            conn.close()
+            flash('That review question is no longer available.', 'error')
+            return redirect(url_for('review'))
+
+        correct_option = next((opt for opt in question['options'] if opt['is_correct']), None)
+        is_correct = correct_option is not None and selected_option == correct_option['id']
+        recorded = record_review(c, user_id, quiz_id, question_id, is_correct, now)
+        conn.commit()
+        conn.close()
+        if not recorded:
+            flash('That question is not due for review yet.', 'error')
+            return redirect(url_for('review'))
+        # Redirect so a refresh shows the feedback again instead of re-answering
+        return redirect(url_for('review', quiz_id=quiz_id, question_id=question_id,
+                                option=selected_option))
+
+    # Feedback for the answer just recorded, carried over from the POST
+    answered_quiz_id = request.args.get('quiz_id')
+    answered_question_id = request.args.get('question_id', type=int)
+    selected_option = request.args.get('option')
+    if answered_quiz_id and answered_question_id is not None and selected_option:
+        quiz, question = find_bank_question(answered_quiz_id, answered_question_id)
+        if question:
+            options = {opt['id']: opt for opt in question['options']}
+            correct_option = next((opt for opt in question['options'] if opt['is_correct']), None)
+            is_correct = correct_option is not None and selected_option == correct_option['id']
+            updated = get_mistake(c, user_id, answered_quiz_id, answered_question_id)
+            feedback = {
+                'is_correct': is_correct,
+                'selected_option_id': selected_option,
+                'selected_option_text': options.get(selected_option, {}).get('text', ''),
+                'correct_option_id': correct_option['id'] if correct_option else None,
+                'correct_option_text': correct_option.get('text', '') if correct_option else '',
+                'learned': updated is None,
+                'next_review_at': updated['due_at'] if updated else None,
+            }
+            summary = get_review_summary(c, user_id, now)
+            conn.close()
+            return render_template('review.html', summary=summary, feedback=feedback,
+                                   quiz=quiz, question=question, mistake=updated)
+
+    # Take the most overdue question that still exists in its bank
+    mistake = quiz = question = None
+    for due in get_due_reviews(c, user_id, now, REVIEW_BATCH_SIZE):
+        quiz, question = find_bank_question(due['quiz_id'], due['question_id'])
+        if question:
+            mistake = due
+            break
+        forget_mistake(c, user_id, due['quiz_id'], due['question_id'])
+    conn.commit()
+    summary = get_review_summary(c, user_id, now)
+    conn.close()
+
+    return render_template('review.html',
+                         summary=summary,
+                         feedback=None,
+                         quiz=quiz,
+                         question=shuffle_options(question) if question else None,
+                         mistake=mistake)
+
+@app.route('/admin/export/<dataset>')
+@require_admin
+def admin_export(dataset):
+    """Stream attempts, answers or coding submissions as CSV/JSONL"""
+    fmt = request.args.get('format', 'csv').lower()
+    compress = request.args.get('gzip') in ('1', 'true', 'yes')
+    filters = {
+        'user_id': request.args.get('user_id', type=int),
+        'quiz_id': request.args.get('quiz_id') or None,
+        'since': request.args.get('since') or None,
+        'until': request.args.get('until') or None,
+    }
+    if dataset not in DATASETS or fmt not in FORMATS:
+        return jsonify({'error': 'Unknown dataset or format'}), 404
+    
+    # A single user's rows live on one shard, everything else fans out
+    if filters['user_id'] is not None:
+        shards = [get_user_db(filters['user_id'])]
+    else:
+        shards = router.connect_all()
+    try:
+        chunks = stream_export(shards, dataset, fmt, compress, **filters)
+    except ValueError as e:
+        close_all(shards)
+        return jsonify({'error': str(e)}), 400
+    
+    def generate():
+        try:
+            yield from chunks
+        finally:
+            close_all(shards)
+    
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if compress:
+        mimetype = 'application/gzip'
+    filename = export_filename(dataset, fmt, compress)
+    return Response(stream_with_context(generate()),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 @app.route('/coding/list')
 @require_login
@@ -680,7 +1152,7 @@ def coding_submit():
         return jsonify({'error': 'Challenge not found'}), 404
     
     # Save submission
-    conn = get_db()
+    conn = get_user_db()
     c = conn.cursor()
     c.execute('''
         INSERT INTO coding_submissions (user_id, challenge_id, code)
@@ -694,7 +1166,221 @@ def coding_submit():
     
     return jsonify({'message': 'Submission saved successfully!'})
 
+@app.cli.command('item-stats')
+@click.option('--full', is_flag=True, help='Discard cached stats and recompute from all attempts.')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True,
+              help='Number of attempts read per chunk.')
+def item_stats_command(full, chunk_size):
+    """Refresh per-question difficulty and discrimination stats"""
+    init_db()
+    conn = get_db()
+    shards = router.connect_all()
+    summary = refresh_question_stats(conn, shards, full=full, chunk_size=chunk_size)
+    flagged = get_flagged_questions(conn)
+    close_all(shards)
+    conn.close()
+    
+    click.echo(f"Processed {summary['attempts']} new attempts across {summary['quizzes']} quizzes.")
+    for row in flagged:
+        discrimination = row['point_biserial']
+        click.echo(f"  {row['quiz_id']} Q{row['question_id']}: "
+                   f"p={row['p_value']:.2f} "
+                   f"r_pb={'n/a' if discrimination is None else f'{discrimination:.2f}'} "
+                   f"options={row['option_counts']}")
+
+@app.cli.command('leaderboard-rebuild')
+@click.option('--quiz', 'quiz_id', default=None, help='Only rebuild the board for this quiz id.')
+def leaderboard_rebuild_command(quiz_id):
+    """Recompute leaderboards from completed attempts"""
+    init_db()
+    written = 0
+    for conn in router.connect_all():
+        written += rebuild_leaderboards(conn, quiz_id=quiz_id)
+        conn.close()
+    click.echo(f'Wrote {written} leaderboard entries.')
+
+@app.cli.command('export-data')
+@click.argument('dataset', type=click.Choice(sorted(DATASETS)))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip-compress the output.')
+@click.option('--user-id', type=int, default=None, help='Only rows for this user.')
+@click.option('--quiz', 'quiz_id', default=None, help='Only rows for this quiz id.')
+@click.option('--since', default=None, help='Start date (inclusive), e.g. 2026-01-01.')
+@click.option('--until', default=None, help='End date (exclusive), e.g. 2026-02-01.')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='Output file (default: stdout).')
+def export_data_command(dataset, fmt, compress, user_id, quiz_id, since, until, output):
+    """Stream a table export to a file or stdout"""
+    init_db()
+    shards = [get_user_db(user_id)] if user_id is not None else router.connect_all()
+    try:
+        for chunk in stream_export(shards, dataset, fmt, compress, user_id=user_id,
+                                   quiz_id=quiz_id, since=since, until=until):
+            output.write(chunk)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    finally:
+        close_all(shards)
+
+@app.cli.command('import-data')
+@click.argument('dataset', type=click.Choice(sorted(DATASETS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+              help='Input format (default: guessed from the file name).')
+def import_data_command(dataset, path, fmt):
+    """Bulk-load an export file; rows whose id is taken by other data get new ids"""
+    init_db()
+    shards = router.connect_all()
+    summary = import_file(shards, router.shard_for_user, dataset, path, fmt)
+    if dataset == 'attempts':
+        for shard in shards:
+            backfill_sort_keys(shard)
+    close_all(shards)
+    click.echo(f"Read {summary['read']} rows, inserted {summary['inserted']} "
+               f"({summary['remapped']} under new ids), skipped {summary['skipped']} already present, "
+               f"refused {summary['conflicts']} conflicting.")
+
+@app.cli.command('compact-answers')
+@click.option('--older-than-days', default=30, show_default=True,
+              help='Only compact attempts completed before this many days ago.')
+@click.option('--batch-size', default=500, show_default=True, help='Attempts per transaction.')
+@click.option('--vacuum', is_flag=True, help='VACUUM afterwards to return freed pages to the OS.')
+def compact_answers_command(older_than_days, batch_size, vacuum):
+    """Pack answer rows of old completed attempts into one row each"""
+    init_db()
+    summary = {'attempts': 0, 'rows': 0, 'skipped': 0, 'bytes_before': 0, 'bytes_after': 0}
+    for conn in router.connect_all():
+        for name, value in compact_attempts(conn, older_than_days, batch_size, vacuum).items():
+            summary[name] += value
+        conn.close()
+    click.echo(f"Packed {summary['attempts']} attempts ({summary['rows']} rows removed, "
+               f"{summary['skipped']} skipped). Database size: "
+               f"{summary['bytes_before'] / 1024:.0f} KiB -> {summary['bytes_after'] / 1024:.0f} KiB.")
+
+@app.cli.command('flush-answers')
+def flush_answers_command():
+    """Write every queued answer to attempt_answers now"""
+    if answer_queue is None:
+        click.echo('ANSWER_QUEUE_PATH is not set; answers are written directly.')
+        return
+    init_db()
+    click.echo(f'Flushed {flush_pending_answers()} queued answers.')
+
+@app.cli.command('expire-attempts')
+@click.option('--batch-size', default=200, show_default=True, help='Attempts graded per transaction.')
+def expire_attempts_command(batch_size):
+    """Grade and close attempts whose time limit has passed"""
+    init_db()
+    flush_pending_answers()
+    finalized = 0
+    for conn in router.connect_all():
+        finalized += expire_attempts(conn, batch_size=batch_size)
+        conn.close()
+    click.echo(f'Finalized {finalized} expired attempts.')
+
+@app.cli.command('regrade')
+@click.option('--quiz', 'quiz_id', default=None, help='Only re-grade this quiz id.')
+@click.option('--batch-size', default=REGRADE_BATCH_SIZE, show_default=True,
+              help='Attempts re-graded per transaction.')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing.')
+def regrade_command(quiz_id, batch_size, dry_run):
+    """Re-grade past answers after answer keys changed in the banks"""
+    init_db()
+    flush_pending_answers()
+    conn = get_db()
+    shards = router.connect_all()
+    results = regrade_all(conn, shards, quiz_id=quiz_id, batch_size=batch_size, dry_run=dry_run)
+    changed_attempts = sum(counts['attempts_changed'] for counts in results.values())
+    if changed_attempts and not dry_run:
+        for shard in shards:
+            rebuild_leaderboards(shard)
+    close_all(shards)
+    conn.close()
+    
+    for bank_id, counts in sorted(results.items()):
+        click.echo(f"  {bank_id}: {counts['questions_changed']} answer keys checked, "
+                   f"{counts['answers_changed']} answers re-graded, "
+                   f"{counts['attempts_changed']} of {counts['attempts_scanned']} attempts changed")
+    prefix = 'Would change' if dry_run else 'Changed'
+    click.echo(f'{prefix} {changed_attempts} attempts across {len(results)} updated banks.')
+    if changed_attempts and not dry_run:
+        click.echo('Leaderboards rebuilt. Run `flask item-stats --full` to refresh question stats.')
+
+@app.cli.command('find-duplicates')
+@click.option('--threshold', default=DUPLICATE_THRESHOLD, show_default=True,
+              type=click.FloatRange(0, 1), help='Estimated similarity from which questions are reported.')
+@click.option('--all', 'full', is_flag=True,
+              help='Report pairs across all banks, not only those touching changed banks.')
+@click.option('--fail-threshold', type=click.FloatRange(0, 1), default=None,
+              help='Exit with an error if any pair is at least this similar (pairs this '
+                   'similar are reported even below --threshold).')
+def find_duplicates_command(threshold, full, fail_threshold):
+    """Report clusters of near-duplicate questions across the banks"""
+    init_db()
+    conn = get_db()
+    # Pairs below --threshold but at --fail-threshold must be scored (and shown) too
+    if fail_threshold is not None:
+        threshold = min(threshold, fail_threshold)
+    report = find_near_duplicates(conn, threshold=threshold, full=full)
+    
+    for number, cluster in enumerate(report['clusters'], start=1):
+        click.echo(f"Cluster {number} (max similarity {cluster['max_similarity']:.2f}):")
+        for (quiz_id, question_id), text in cluster['members']:
+            click.echo(f'  {quiz_id} Q{question_id}: {text[:80]}')
+        for (quiz_a, qid_a), (quiz_b, qid_b), similarity in cluster['pairs']:
+            click.echo(f'    {quiz_a} Q{qid_a} ~ {quiz_b} Q{qid_b}: {similarity:.2f}')
+    click.echo(f"Checked {report['questions']} questions in {report['banks']} banks "
+               f"({len(report['changed'])} changed): {report['candidates']} candidate pairs, "
+               f"{report['pairs']} near-duplicate pairs in {len(report['clusters'])} clusters.")
+    
+    worst = max((cluster['max_similarity'] for cluster in report['clusters']), default=0)
+    if fail_threshold is not None and report['clusters'] and worst >= fail_threshold:
+        # Keep the old signatures so the offending banks are checked again next run
+        conn.rollback()
+        conn.close()
+        raise click.ClickException(f'Near-duplicate questions up to {worst:.2f} similar '
+                                   f'(fail threshold {fail_threshold:.2f}).')
+    conn.commit()
+    conn.close()
+
+@app.cli.command('reshard')
+@click.option('--shards', 'shard_count', type=click.IntRange(min=1), required=True,
+              help='Number of shard files to spread per-user data across.')
+@click.option('--batch-size', default=RESHARD_BATCH_SIZE, show_default=True,
+              help='Rows copied per batch.')
+@click.option('--drop-source', is_flag=True,
+              help='Remove the old copies of the moved tables once the copy is verified.')
+def reshard_command(shard_count, batch_size, drop_source):
+    """Move attempts and answers into a new set of shard files (stop the app first)"""
+    init_db()
+    flush_pending_answers()
+    try:
+        summary = reshard(router, shard_count, init_shard_schema, batch_size, drop_source)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    
+    for table, count in summary['counts'].items():
+        click.echo(f'  {table}: {count} rows')
+    for path in summary['paths']:
+        click.echo(f'  -> {path}')
+    if summary['dropped']:
+        click.echo(f"Removed old copies from {', '.join(summary['dropped'])}.")
+    else:
+        click.echo(f"Old copies left in place: {', '.join(summary['old_paths'])}.")
+    click.echo('Restart the app server and workers to pick up the new layout.')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minify, fingerprint and precompress the static bundles"""
+    manifest = build_assets(app.static_folder)
+    for source, hashed in sorted(manifest.items()):
+        click.echo(f'{source} -> {hashed}')
+    click.echo('Restart the app server to pick up the new manifest.')
+
 if __name__ == '__main__':
     init_db()
+    # With the reloader on, only start the sweeper in the serving child process
+    if app.config['EXPIRY_SWEEP_INTERVAL'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_sweeper(router.connect_all, app.config['EXPIRY_SWEEP_INTERVAL'], app.logger,
+                      before_sweep=flush_pending_answers)
     app.run(debug=True, host='0.0.0.0', port=5011)
 
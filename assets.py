@@ -0,0 +1,205 @@
+"""
+Static Asset Pipeline
+Builds fingerprinted, minified and precompressed copies of the site bundles
+and serves them with far-future immutable caching.
+
+``flask build-assets`` writes ``static/dist/<path>.<hash>.<ext>`` plus ``.gz``
+(and ``.br`` when the optional ``brotli`` package is installed) next to a
+``manifest.json``. Once a manifest exists, ``url_for('static', filename=...)``
+transparently resolves bundled files to their hashed names.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are always built
+    brotli = None
+
+BUNDLES = ['css/style.css', 'js/main.js']
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# (Accept-Encoding token, file suffix) in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def _scan(source: str, on_code, keep_newlines: bool, regex_literals: bool) -> str:
+    """Drop comments and collapse whitespace outside string literals.
+
+    ``on_code`` post-processes each run of code between literals.
+    """
+    out = []
+    code = []
+    i, n = 0, len(source)
+    last_significant = ''
+
+    def flush():
+        if code:
+            out.append(on_code(''.join(code)))
+            code.clear()
+
+    while i < n:
+        ch = source[i]
+        nxt = source[i + 1] if i + 1 < n else ''
+        if ch == '/' and nxt == '*':
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            code.append(' ')
+            continue
+        if keep_newlines and ch == '/' and nxt == '/':
+            end = source.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        is_regex = (regex_literals and ch == '/'
+                    and (last_significant == '' or last_significant in '(,=:[!&|?{};+-*%<>~^'))
+        if ch in '\'"`' or is_regex:
+            flush()
+            j = i + 1
+            in_class = False
+            while j < n:
+                if source[j] == '\\':
+                    j += 2
+                    continue
+                if is_regex and source[j] == '[':
+                    in_class = True
+                elif is_regex and source[j] == ']':
+                    in_class = False
+                elif source[j] == ch and not in_class:
+                    break
+                j += 1
+            j += 1
+            if is_regex:
+                while j < n and source[j].isalpha():
+                    j += 1
+            out.append(source[i:j])
+            last_significant = ch
+            i = j
+            continue
+        if not ch.isspace():
+            last_significant = ch
+        code.append(ch)
+        i += 1
+    flush()
+    return ''.join(out)
+
+
+def minify_css(source: str) -> str:
+    def squeeze(code: str) -> str:
+        code = re.sub(r'\s+', ' ', code)
+        return re.sub(r'\s*([{};,])\s*', r'\1', code)
+
+    return _scan(source, squeeze, keep_newlines=False, regex_literals=False).strip()
+
+
+def minify_js(source: str) -> str:
+    """Conservative JS minifier: comments and indentation go, newlines stay for ASI."""
+    def squeeze(code: str) -> str:
+        code = re.sub(r'[ \t]+', ' ', code)
+        return re.sub(r' ?\n[\s]*', '\n', code)
+
+    return _scan(source, squeeze, keep_newlines=True, regex_literals=True).strip() + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def build_assets(static_folder: str, bundles=None) -> Dict[str, str]:
+    """Minify, fingerprint and precompress bundles; returns the written manifest."""
+    dist_root = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    written = set()
+
+    for filename in bundles or BUNDLES:
+        base, ext = os.path.splitext(filename)
+        with open(os.path.join(static_folder, filename), 'r', encoding='utf-8') as f:
+            source = f.read()
+        minify = MINIFIERS.get(ext)
+        data = (minify(source) if minify else source).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        hashed = f'{base}.{digest}{ext}'
+
+        target = os.path.join(dist_root, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        with open(target + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(target + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+
+        manifest[filename] = f'{DIST_DIR}/{hashed}'
+        written.update({target, target + '.gz', target + '.br'})
+
+    # Remove bundles left over from previous builds
+    for dirpath, _, files in os.walk(dist_root):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            if name != MANIFEST_NAME and path not in written:
+                os.remove(path)
+
+    with open(os.path.join(dist_root, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder: str) -> Dict[str, str]:
+    path = os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _pick_encoding(static_folder: str, filename: str) -> Optional[tuple]:
+    accepted = request.accept_encodings
+    for token, suffix in ENCODINGS:
+        if accepted[token] and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+            return token, suffix
+    return None
+
+
+def init_assets(app) -> None:
+    """Hook hashed asset URLs into url_for and serve them with immutable caching."""
+    manifest = load_manifest(app.static_folder)
+    hashed_files = set(manifest.values())
+    app.extensions['asset_manifest'] = manifest
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    plain_static = app.view_functions['static']
+
+    def static(filename):
+        if filename not in hashed_files:
+            return plain_static(filename=filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = _pick_encoding(app.static_folder, filename)
+        if encoding:
+            response = send_from_directory(app.static_folder, filename + encoding[1],
+                                           mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding[0]
+        else:
+            response = send_from_directory(app.static_folder, filename,
+                                           mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = static
@@ -0,0 +1,164 @@
+"""
+Attempt Expiry Module
+Finalizes quiz attempts whose time limit has passed without a submit.
+
+Open attempts carry an ``expires_at`` deadline and are found through a
+partial index on it, then graded in batches with set-based SQL. The sweep can
+run from cron (``flask expire-attempts``) or as an in-process daemon thread.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from data_loader import get_quiz_by_id
+from leaderboard import DURATION_SQL, record_score
+from mistake_index import record_attempt_mistakes
+
+DEFAULT_BATCH_SIZE = 200
+# Slack for requests that were in flight when the timer ran out
+EXPIRY_GRACE_SECONDS = 30
+DEFAULT_DURATION_MINUTES = 15
+
+
+def quiz_duration_minutes(quiz: Optional[Dict]) -> int:
+    if not quiz:
+        return DEFAULT_DURATION_MINUTES
+    return quiz.get('duration_minutes', DEFAULT_DURATION_MINUTES)
+
+
+def attempt_deadline(started_at: datetime, quiz: Optional[Dict]) -> datetime:
+    """Return the moment an attempt started at ``started_at`` runs out of time."""
+    return started_at + timedelta(minutes=quiz_duration_minutes(quiz))
+
+
+def is_past_deadline(deadline: Optional[datetime], now: Optional[datetime] = None,
+                     grace_seconds: int = EXPIRY_GRACE_SECONDS) -> bool:
+    if deadline is None:
+        return False
+    now = now or datetime.now()
+    return now > deadline + timedelta(seconds=grace_seconds)
+
+
+def backfill_expiry(conn) -> int:
+    """Set ``expires_at`` on open attempts created before the column existed."""
+    quiz_ids = [row[0] for row in conn.execute('''
+        SELECT DISTINCT quiz_id FROM attempts
+        WHERE completed_at IS NULL AND expires_at IS NULL
+    ''').fetchall()]
+    updated = 0
+    for quiz_id in quiz_ids:
+        minutes = quiz_duration_minutes(get_quiz_by_id(quiz_id))
+        updated += conn.execute('''
+            UPDATE attempts
+            SET expires_at = strftime('%Y-%m-%d %H:%M:%f', started_at, ?)
+            WHERE completed_at IS NULL AND expires_at IS NULL AND quiz_id = ?
+        ''', (f'+{minutes} minutes', quiz_id)).rowcount
+    conn.commit()
+    return updated
+
+
+def _grade_batch(conn, attempt_ids) -> int:
+    # Stamped per batch, right before its commit, so incremental jobs reading
+    # completed_at (item_analysis) see it within their safety lag
+    now = datetime.now()
+    placeholders = ', '.join('?' for _ in attempt_ids)
+    quiz_ids = [row[0] for row in conn.execute(
+        f'SELECT DISTINCT quiz_id FROM attempts WHERE id IN ({placeholders})', attempt_ids
+    ).fetchall()]
+    sizes = [(quiz_id, len((get_quiz_by_id(quiz_id) or {}).get('questions', [])))
+             for quiz_id in quiz_ids]
+
+    conn.execute(f'''
+        WITH quiz_sizes (quiz_id, question_count) AS (
+            VALUES {', '.join('(?, ?)' for _ in sizes)}
+        ),
+        graded AS (
+            SELECT a.id AS attempt_id,
+                   MAX(COALESCE(s.question_count, 0)) AS question_count,
+                   COALESCE(SUM(COALESCE(aa.selected_option_id, '') <> '' AND aa.is_correct = 1), 0) AS correct,
+                   COALESCE(SUM(COALESCE(aa.selected_option_id, '') <> '' AND aa.is_correct = 0), 0) AS wrong
+            FROM attempts a
+            LEFT JOIN quiz_sizes s ON s.quiz_id = a.quiz_id
+            LEFT JOIN attempt_answers aa ON aa.attempt_id = a.id
+            WHERE a.id IN ({placeholders})
+            GROUP BY a.id
+        )
+        UPDATE attempts
+        SET score = g.correct,
+            total_correct = g.correct,
+            total_wrong = g.wrong,
+            total_unanswered = MAX(g.question_count - g.correct - g.wrong, 0),
+            completed_at = ?,
+            sort_at = ?
+        FROM graded g
+        WHERE attempts.id = g.attempt_id AND attempts.completed_at IS NULL
+    ''', (*[value for pair in sizes for value in pair], *attempt_ids, now, now))
+
+    # Rows stamped with this sweep's time are the ones closed here; they
+    # still count towards the leaderboards
+    rows = conn.execute(f'''
+        SELECT id, user_id, quiz_id, score, completed_at,
+               {DURATION_SQL} AS duration_seconds
+        FROM attempts
+        WHERE id IN ({placeholders}) AND completed_at = ?
+    ''', (*attempt_ids, now)).fetchall()
+    c = conn.cursor()
+    for row in rows:
+        record_score(c, row['user_id'], row['quiz_id'], row['id'], row['score'],
+                     row['duration_seconds'], row['completed_at'])
+    record_attempt_mistakes(c, [row['id'] for row in rows], now)
+    conn.commit()
+    return len(rows)
+
+
+def expire_attempts(conn, batch_size: int = DEFAULT_BATCH_SIZE,
+                    grace_seconds: int = EXPIRY_GRACE_SECONDS,
+                    now: Optional[datetime] = None) -> int:
+    """Grade and close every open attempt past its deadline; returns how many were closed."""
+    backfill_expiry(conn)
+    now = now or datetime.now()
+    cutoff = now - timedelta(seconds=grace_seconds)
+    finalized = 0
+    while True:
+        attempt_ids = [row[0] for row in conn.execute('''
+            SELECT id FROM attempts INDEXED BY idx_attempts_open_expiry
+            WHERE completed_at IS NULL AND expires_at <= ?
+            ORDER BY expires_at
+            LIMIT ?
+        ''', (cutoff, batch_size)).fetchall()]
+        if not attempt_ids:
+            return finalized
+        finalized += _grade_batch(conn, attempt_ids)
+
+
+def start_sweeper(connect_all: Callable, interval_seconds: int, logger=None,
+                  before_sweep: Optional[Callable] = None) -> threading.Thread:
+    """Run :func:`expire_attempts` every ``interval_seconds`` on a daemon thread.
+
+    ``connect_all`` must return new connections with ``sqlite3.Row`` rows,
+    one per shard; they are opened and closed per sweep. ``before_sweep``
+    runs first, e.g. to flush answers that are still queued.
+    """
+    def loop():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                if before_sweep:
+                    before_sweep()
+                finalized = 0
+                for conn in connect_all():
+                    try:
+                        finalized += expire_attempts(conn)
+                    finally:
+                        conn.close()
+                if finalized and logger:
+                    logger.info('Finalized %d expired attempts', finalized)
+            except Exception:
+                if logger:
+                    logger.exception('Expiry sweep failed')
+
+    thread = threading.Thread(target=loop, name='attempt-expiry-sweeper', daemon=True)
+    thread.start()
+    return thread
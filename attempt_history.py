@@ -0,0 +1,97 @@
+"""
+Attempt History Module
+Cursor-paginated listing of a user's attempts, newest first.
+
+Attempts carry a stored ``sort_at`` key (completion time, or start time while
+open) that is covered by ``idx_attempts_history``, together with every column
+a history row needs. Pages continue from an opaque cursor holding the last
+``(sort_at, id)`` seen, so fetching page N is one index seek plus ``limit``
+index entries, the same as page 1, and no table rows are read.
+"""
+
+import base64
+from typing import Dict, List, Optional, Tuple
+
+from data_export import parse_iso_date
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+HISTORY_COLUMNS = ['id', 'quiz_id', 'score', 'total_correct', 'total_wrong',
+                   'total_unanswered', 'completed_at', 'sort_at']
+
+
+def backfill_sort_keys(conn) -> int:
+    """Fill ``sort_at`` for attempts written before the column existed or imported without it."""
+    updated = conn.execute('''
+        UPDATE attempts
+        SET sort_at = COALESCE(completed_at, started_at)
+        WHERE sort_at IS NULL
+    ''').rowcount
+    conn.commit()
+    return updated
+
+
+def encode_cursor(sort_at: str, attempt_id: int) -> str:
+    raw = f'{sort_at}|{attempt_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        sort_at, attempt_id = raw.rsplit('|', 1)
+        return sort_at, int(attempt_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+
+def get_history_page(c, user_id: int, quiz_id: Optional[str] = None,
+                     level: Optional[str] = None, since: Optional[str] = None,
+                     until: Optional[str] = None, cursor: Optional[str] = None,
+                     limit: int = PAGE_SIZE) -> Tuple[List[Dict], Optional[str]]:
+    """Return one page of attempts and the cursor of the next page (None on the last).
+
+    ``since`` is inclusive and ``until`` exclusive, both on ``sort_at``.
+    Raises ``ValueError`` for a malformed cursor or date.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    conditions = ['user_id = ?']
+    params: list = [user_id]
+    if quiz_id:
+        conditions.append('quiz_id = ?')
+        params.append(quiz_id)
+    if level:
+        # Quiz ids end in _<level>; '_' is a LIKE wildcard, so escape it
+        conditions.append("quiz_id LIKE ? ESCAPE '\\'")
+        params.append(f'%\\_{level}')
+    since = parse_iso_date(since, 'since')
+    if since:
+        conditions.append('sort_at >= ?')
+        params.append(since)
+    # The cursor and ``until`` are folded into one upper bound so the index
+    # seek starts at the cursor; (until, 0) sorts before every id at ``until``
+    upper = None
+    until = parse_iso_date(until, 'until')
+    if until:
+        upper = (until, 0)
+    if cursor:
+        upper = min(upper, decode_cursor(cursor)) if upper else decode_cursor(cursor)
+    if upper:
+        conditions.append('(sort_at, id) < (?, ?)')
+        params.extend(upper)
+
+    c.execute(f'''
+        SELECT {', '.join(HISTORY_COLUMNS)}
+        FROM attempts
+        WHERE {' AND '.join(conditions)}
+        ORDER BY sort_at DESC, id DESC
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = [dict(row) for row in c.fetchall()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['sort_at'], rows[-1]['id'])
+    return rows, next_cursor
@@ -0,0 +1,117 @@
+"""
+Result page benchmark
+Measures time-to-first-byte, total time and transferred bytes of /result for
+synthetic 50- and 500-question attempts, comparing the old buffered render
+with the streamed render, with and without gzip.
+
+Usage: python benchmarks/result_page.py [--runs N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+from data_loader import load_quiz  # noqa: E402
+
+
+def make_quiz(size):
+    """Build a synthetic quiz of ``size`` questions by repeating the Python banks."""
+    source = []
+    for level in ('easy', 'medium', 'hard'):
+        source.extend(load_quiz('python', level)['questions'])
+    questions = []
+    for i in range(size):
+        question = dict(source[i % len(source)])
+        question['id'] = i + 1
+        questions.append(question)
+    quiz = dict(load_quiz('python', 'easy'))
+    quiz.update(quiz_id=f'bench_{size}', questions=questions)
+    return quiz
+
+
+def seed(quiz):
+    main = app_module.get_db()
+    user_id = main.execute("INSERT INTO users (name, email, password_hash) VALUES ('Bench', ?, 'x')",
+                           (f"bench-{quiz['quiz_id']}@example.com",)).lastrowid
+    main.commit()
+    main.close()
+
+    conn = app_module.get_user_db(user_id)
+    c = conn.cursor()
+    now = datetime.now()
+    c.execute('''INSERT INTO attempts (user_id, quiz_id, started_at, completed_at, score)
+                 VALUES (?, ?, ?, ?, 0)''', (user_id, quiz['quiz_id'], now, now))
+    attempt_id = c.lastrowid
+    c.executemany('''INSERT INTO attempt_answers (attempt_id, quiz_id, question_id, selected_option_id, is_correct)
+                     VALUES (?, ?, ?, 'a', ?)''',
+                  [(attempt_id, quiz['quiz_id'], q['id'], int(q['options'][0]['is_correct']))
+                   for q in quiz['questions']])
+    conn.commit()
+    conn.close()
+    return user_id, attempt_id
+
+
+def measure(client, path, accept_encoding):
+    environ_headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+    start = time.perf_counter()
+    response = client.get(path, headers=environ_headers, buffered=False)
+    chunks = iter(response.response)
+    first = next(chunks)
+    ttfb = time.perf_counter() - start
+    size = len(first) + sum(len(chunk) for chunk in chunks)
+    total = time.perf_counter() - start
+    response.close()
+    return ttfb, total, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    app = app_module.app
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config['DATABASE'] = os.path.join(tmp, 'bench.db')
+        app_module.init_db()
+
+        streamed_view = app.view_functions['result']
+
+        def buffered_view(attempt_id):
+            response = streamed_view(attempt_id)
+            if response.is_streamed:
+                response.set_data(b''.join(response.iter_encoded()))
+            return response
+
+        original_get_quiz_by_id = app_module.get_quiz_by_id
+        try:
+            print(f"{'questions':>9} {'mode':<9} {'encoding':<8} {'TTFB ms':>8} {'total ms':>9} {'bytes':>9}")
+            for size in (50, 500):
+                quiz = make_quiz(size)
+                app_module.get_quiz_by_id = lambda quiz_id, quiz=quiz: quiz
+                user_id, attempt_id = seed(quiz)
+
+                client = app.test_client()
+                with client.session_transaction() as sess:
+                    sess.update(user_id=user_id, user_name='Bench', user_email='bench@example.com')
+
+                for mode, view in (('buffered', buffered_view), ('streamed', streamed_view)):
+                    app.view_functions['result'] = view
+                    for encoding in ('', 'gzip'):
+                        samples = [measure(client, f'/result/{attempt_id}', encoding) for _ in range(args.runs)]
+                        ttfb = sorted(s[0] for s in samples)[len(samples) // 2] * 1000
+                        total = sorted(s[1] for s in samples)[len(samples) // 2] * 1000
+                        print(f'{size:>9} {mode:<9} {encoding or "identity":<8} {ttfb:>8.2f} {total:>9.2f} {samples[0][2]:>9}')
+                app.view_functions['result'] = streamed_view
+        finally:
+            app_module.get_quiz_by_id = original_get_quiz_by_id
+            app.view_functions['result'] = streamed_view
+
+
+if __name__ == '__main__':
+    main()
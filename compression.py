@@ -0,0 +1,62 @@
+"""
+Response Compression
+Gzip-compresses HTML and JSON responses for clients that accept it.
+
+Buffered responses are compressed in one go; streamed responses are
+compressed chunk by chunk with a sync flush, so the browser can start
+rendering each chunk as soon as it arrives.
+"""
+
+import gzip
+import zlib
+
+from flask import request
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json'}
+# Below this the gzip framing costs more than it saves
+MIN_COMPRESS_SIZE = 500
+COMPRESS_LEVEL = 6
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        # Sync flush keeps each chunk decodable on arrival
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _should_compress(response) -> bool:
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return False
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return False
+    return bool(request.accept_encodings['gzip'])
+
+
+def init_compression(app) -> None:
+    """Register an after_request hook that gzips HTML and JSON responses."""
+
+    @app.after_request
+    def compress_response(response):
+        if not _should_compress(response):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        if response.is_streamed:
+            response.response = _gzip_stream(response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < MIN_COMPRESS_SIZE:
+                return response
+            response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
@@ -0,0 +1,350 @@
+"""
+Data Export Module
+Streams attempts, attempt answers and coding submissions out of the database
+as CSV or JSON Lines (optionally gzip-compressed), and loads such files back.
+
+Rows are read with keyset pagination on the primary key and serialized one
+page at a time, so memory use does not grow with the size of the export.
+Answers archived by ``compact-answers`` live in ``attempt_answer_packs`` and
+are exported as their own dataset, with the packed blobs base64-encoded.
+With sharded storage an export reads the shards one after another, and an
+import sends each row to the shard of the user it belongs to.
+"""
+
+import base64
+import csv
+import gzip
+import io
+import itertools
+import json
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+PAGE_SIZE = 1000
+FORMATS = ('csv', 'jsonl')
+
+DATASETS = {
+    'attempts': {
+        'table': 'attempts',
+        'columns': ['id', 'user_id', 'quiz_id', 'score', 'started_at', 'completed_at',
+                    'total_correct', 'total_wrong', 'total_unanswered', 'expires_at'],
+        'source': 'attempts t',
+        'user_column': 't.user_id',
+        'quiz_column': 't.quiz_id',
+        'time_column': 't.started_at',
+        'route_by': 'user_id',
+    },
+    'attempt_answers': {
+        'table': 'attempt_answers',
+        'columns': ['id', 'attempt_id', 'quiz_id', 'question_id', 'selected_option_id',
+                    'is_correct'],
+        'source': 'attempt_answers t JOIN attempts a ON a.id = t.attempt_id',
+        'user_column': 'a.user_id',
+        'quiz_column': 't.quiz_id',
+        'time_column': 'a.started_at',
+        'route_by': 'attempt_id',
+    },
+    'attempt_answer_packs': {
+        'table': 'attempt_answer_packs',
+        'key': 'attempt_id',
+        'columns': ['attempt_id', 'selected', 'correct'],
+        'blob_columns': ['selected', 'correct'],
+        'source': 'attempt_answer_packs t JOIN attempts a ON a.id = t.attempt_id',
+        'user_column': 'a.user_id',
+        'quiz_column': 'a.quiz_id',
+        'time_column': 'a.started_at',
+        'route_by': 'attempt_id',
+    },
+    'coding_submissions': {
+        'table': 'coding_submissions',
+        'columns': ['id', 'user_id', 'challenge_id', 'code', 'submitted_at'],
+        'source': 'coding_submissions t',
+        'user_column': 't.user_id',
+        'quiz_column': None,
+        'time_column': 't.submitted_at',
+        'route_by': 'user_id',
+    },
+}
+
+
+def parse_iso_date(value: Optional[str], name: str) -> Optional[str]:
+    """Parse an ISO date filter into the ``str(datetime)`` form timestamps are stored in.
+
+    Stored timestamps compare as text, so '2026-01-31T10:00' has to become
+    '2026-01-31 10:00:00' before it is used as a bound.
+    """
+    if not value:
+        return None
+    try:
+        return str(datetime.fromisoformat(value))
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO date such as 2026-01-31')
+
+
+def iter_rows(conn, dataset: str, user_id: Optional[int] = None,
+              quiz_id: Optional[str] = None, since: Optional[str] = None,
+              until: Optional[str] = None, page_size: int = PAGE_SIZE) -> Iterator[Dict]:
+    """Yield rows of a dataset as dicts in primary-key order.
+
+    ``since`` is inclusive and ``until`` exclusive; both filter on the attempt
+    start time (submission time for coding submissions). Blob columns are
+    returned base64-encoded.
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f'Unknown dataset: {dataset}')
+    spec = DATASETS[dataset]
+    key = spec.get('key', 'id')
+    blob_columns = spec.get('blob_columns', [])
+
+    conditions = [f't.{key} > ?']
+    params: list = []
+    if user_id is not None:
+        conditions.append(f"{spec['user_column']} = ?")
+        params.append(user_id)
+    if quiz_id:
+        if not spec['quiz_column']:
+            raise ValueError(f'{dataset} cannot be filtered by quiz')
+        conditions.append(f"{spec['quiz_column']} = ?")
+        params.append(quiz_id)
+    since = parse_iso_date(since, 'since')
+    until = parse_iso_date(until, 'until')
+    if since:
+        conditions.append(f"{spec['time_column']} >= ?")
+        params.append(since)
+    if until:
+        conditions.append(f"{spec['time_column']} < ?")
+        params.append(until)
+
+    query = f'''
+        SELECT {', '.join('t.' + col for col in spec['columns'])}
+        FROM {spec['source']}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY t.{key}
+        LIMIT ?
+    '''
+    last_id = 0
+    while True:
+        page = conn.execute(query, (last_id, *params, page_size)).fetchall()
+        if not page:
+            return
+        for row in page:
+            record = dict(zip(spec['columns'], row))
+            for col in blob_columns:
+                record[col] = base64.b64encode(record[col]).decode('ascii')
+            yield record
+        last_id = page[-1][spec['columns'].index(key)]
+
+
+def _serialize_csv(columns: List[str], rows: Iterable[Dict],
+                   page_size: int) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for i, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if i % page_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _serialize_jsonl(rows: Iterable[Dict], page_size: int) -> Iterator[str]:
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, default=str))
+        if len(lines) >= page_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _gzip_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(conns, dataset: str, fmt: str = 'csv', compress: bool = False,
+                  page_size: int = PAGE_SIZE, **filters) -> Iterator[bytes]:
+    """Return a generator of encoded export chunks for a dataset.
+
+    ``conns`` are the shards to read, in order. Filters are passed through to
+    :func:`iter_rows`. Invalid arguments raise ``ValueError`` before the first
+    chunk is produced.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown export format: {fmt}')
+    rows = itertools.chain.from_iterable(
+        iter_rows(conn, dataset, page_size=page_size, **filters) for conn in conns)
+    # Prime the generator so bad filters fail here rather than mid-response
+    first = next(rows, None)
+
+    def all_rows():
+        if first is not None:
+            yield first
+            yield from rows
+
+    if fmt == 'csv':
+        text_chunks = _serialize_csv(DATASETS[dataset]['columns'], all_rows(), page_size)
+    else:
+        text_chunks = _serialize_jsonl(all_rows(), page_size)
+    encoded = (chunk.encode('utf-8') for chunk in text_chunks if chunk)
+    return _gzip_stream(encoded) if compress else encoded
+
+
+def export_filename(dataset: str, fmt: str, compress: bool) -> str:
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    return f"{dataset}-{stamp}.{fmt}{'.gz' if compress else ''}"
+
+
+def _open_text(path: str):
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def _read_records(handle, fmt: str) -> Iterator[Dict]:
+    if fmt == 'csv':
+        for row in csv.DictReader(handle):
+            # CSV has no NULL, empty cells round-trip as None
+            yield {key: (value if value != '' else None) for key, value in row.items()}
+    else:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _id_map(shards, dataset: str, source_ids) -> Dict[int, int]:
+    """New ids earlier imports gave to ``dataset`` rows whose original id was taken."""
+    source_ids = list(source_ids)
+    placeholders = ', '.join('?' for _ in source_ids)
+    mapped = {}
+    for conn in shards:
+        mapped.update(conn.execute(f'''
+            SELECT source_id, target_id FROM imported_ids
+            WHERE dataset = ? AND source_id IN ({placeholders})
+        ''', (dataset, *source_ids)).fetchall())
+    return mapped
+
+
+def _route_batch(shards, shard_for_user: Callable, spec: Dict,
+                 records: List[Dict]) -> Dict[int, List[Dict]]:
+    """Group records by target shard: by user, or by the shard holding their attempt.
+
+    Records routed by attempt have their ``attempt_id`` rewritten when the
+    attempt was imported under a new id.
+    """
+    if spec['route_by'] == 'user_id':
+        owner = {id(record): shard_for_user(int(record['user_id'])) for record in records}
+    else:
+        remapped = _id_map(shards, 'attempts', {int(record['attempt_id']) for record in records})
+        for record in records:
+            attempt_id = int(record['attempt_id'])
+            record['attempt_id'] = remapped.get(attempt_id, attempt_id)
+        attempt_ids = list({record['attempt_id'] for record in records})
+        placeholders = ', '.join('?' for _ in attempt_ids)
+        attempt_shard = {}
+        for index, conn in enumerate(shards):
+            for row in conn.execute(f'SELECT id FROM attempts WHERE id IN ({placeholders})',
+                                    attempt_ids).fetchall():
+                attempt_shard[row[0]] = index
+        # Answers whose attempt is missing go to the first shard
+        owner = {id(record): attempt_shard.get(record['attempt_id'], 0) for record in records}
+    grouped: Dict[int, List[Dict]] = {}
+    for record in records:
+        grouped.setdefault(owner[id(record)], []).append(record)
+    return grouped
+
+
+def import_file(shards, shard_for_user: Callable, dataset: str, path: str,
+                fmt: Optional[str] = None, batch_size: int = PAGE_SIZE) -> Dict[str, int]:
+    """Bulk-load an export file into its table, keeping the original ids where possible.
+
+    ``shards`` are connections to every shard and ``shard_for_user`` maps a
+    user id to an index into them. A row identical to one already stored is
+    skipped, so an interrupted import can be re-run. A row whose id is taken
+    by different data is inserted under a new id, recorded in
+    ``imported_ids``; answers and packs imported afterwards follow their
+    attempt to its new id. Packs are keyed by attempt, so a pack that differs
+    from the stored one is refused. Import attempts before their answers, and
+    one source database at a time. Referenced users must already exist on the
+    target. Returns counts of rows read, inserted (of which remapped to new
+    ids), skipped and refused as conflicting.
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f'Unknown dataset: {dataset}')
+    if fmt is None:
+        fmt = 'jsonl' if '.jsonl' in path else 'csv'
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown import format: {fmt}')
+
+    spec = DATASETS[dataset]
+    columns = spec['columns']
+    key = spec.get('key', 'id')
+    values_columns = [col for col in columns if col != key]
+    blob_columns = spec.get('blob_columns', [])
+    insert = f'''
+        INSERT OR IGNORE INTO {spec['table']} ({key}, {', '.join(values_columns)})
+        VALUES (?, {', '.join('?' for _ in values_columns)})
+    '''
+    insert_new_id = f'''
+        INSERT INTO {spec['table']} ({', '.join(values_columns)})
+        VALUES ({', '.join('?' for _ in values_columns)})
+    '''
+    # IS also matches NULLs; column affinity makes CSV text compare equal to stored numbers
+    same_row = f'''
+        SELECT 1 FROM {spec['table']}
+        WHERE {key} = ? AND {' AND '.join(f'{col} IS ?' for col in values_columns)}
+    '''
+    counts = dict.fromkeys(('inserted', 'remapped', 'skipped', 'conflicts'), 0)
+
+    def load(records: List[Dict]) -> None:
+        mapped = _id_map(shards, dataset, {int(record[key]) for record in records}) \
+            if key == 'id' else {}
+        for index, group in _route_batch(shards, shard_for_user, spec, records).items():
+            conn = shards[index]
+            for record in group:
+                for col in blob_columns:
+                    record[col] = base64.b64decode(record[col])
+                source_id = int(record[key])
+                values = tuple(record.get(col) for col in values_columns)
+                if source_id in mapped and conn.execute(same_row, (mapped[source_id], *values)).fetchone():
+                    counts['skipped'] += 1
+                elif conn.execute(insert, (source_id, *values)).rowcount:
+                    counts['inserted'] += 1
+                elif conn.execute(same_row, (source_id, *values)).fetchone():
+                    counts['skipped'] += 1
+                elif key == 'id':
+                    target_id = conn.execute(insert_new_id, values).lastrowid
+                    conn.execute('''
+                        INSERT OR REPLACE INTO imported_ids (dataset, source_id, target_id)
+                        VALUES (?, ?, ?)
+                    ''', (dataset, source_id, target_id))
+                    counts['inserted'] += 1
+                    counts['remapped'] += 1
+                else:
+                    counts['conflicts'] += 1
+            conn.commit()
+
+    read = 0
+    batch = []
+    with _open_text(path) as handle:
+        for record in _read_records(handle, fmt):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                load(batch)
+                read += len(batch)
+                batch = []
+        if batch:
+            load(batch)
+            read += len(batch)
+
+    return {'read': read, **counts}
@@ -8,7 +8,7 @@ import os
 import random
 import copy
 from functools import lru_cache
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 MCQ_DIR = os.path.join(DATA_DIR, 'mcq')
@@ -158,6 +158,15 @@ def load_quiz_catalog() -> List[Dict]:
     return catalog
 
 
+def iter_banks() -> Iterator[Tuple[str, Dict]]:
+    """Yield (quiz_id, quiz) for every bank on disk, keyed the way attempts store it."""
+    for language in LANGUAGES:
+        for level in LEVELS:
+            quiz = load_quiz(language, level)
+            if quiz and quiz.get('quiz_id'):
+                yield quiz['quiz_id'], quiz
+
+
 @lru_cache(maxsize=1)
 def load_coding_challenges() -> List[Dict]:
     """Load all coding challenges from coding_challenges.json"""
@@ -0,0 +1,286 @@
+"""
+Item Analysis Module
+Computes per-question difficulty (p-value), discrimination (point-biserial
+against the attempt score) and distractor frequencies from completed attempts,
+and caches them in the question_stats table.
+
+Statistics are kept as running sums so a refresh only has to read the
+attempts completed since the previous run. With sharded storage each shard is
+read up to the same horizon, so one watermark covers all of them.
+"""
+
+import json
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from answer_store import load_packed_answers
+from data_loader import get_quiz_by_id
+
+JOB_NAME = 'question_stats'
+DEFAULT_CHUNK_SIZE = 500
+# completed_at is stamped before the row commits; attempts younger than this
+# are left for the next run so a late commit is never skipped
+WATERMARK_LAG_SECONDS = 300
+UNANSWERED_KEY = 'unanswered'
+
+# Thresholds used to flag questions worth a second look
+MIN_RESPONSES_FOR_FLAG = 20
+MIN_P_VALUE = 0.15
+MAX_P_VALUE = 0.95
+MIN_DISCRIMINATION = 0.1
+
+
+class _QuizAccumulator:
+    """Running sums for every question of one quiz bank."""
+
+    def __init__(self, quiz: Dict):
+        questions = quiz.get('questions', [])
+        self.question_ids = [q['id'] for q in questions]
+        self.columns = {qid: col for col, qid in enumerate(self.question_ids)}
+        self.option_ids = [[opt['id'] for opt in q.get('options', [])] for q in questions]
+        self.option_index = [{opt_id: k for k, opt_id in enumerate(ids)} for ids in self.option_ids]
+        self.width = max((len(ids) for ids in self.option_ids), default=0) + 1
+
+        size = len(self.question_ids)
+        self.responses = np.zeros(size, dtype=np.int64)
+        self.correct = np.zeros(size, dtype=np.int64)
+        self.sum_score = np.zeros(size, dtype=np.float64)
+        self.sum_score_sq = np.zeros(size, dtype=np.float64)
+        self.sum_correct_score = np.zeros(size, dtype=np.float64)
+        self.option_counts = np.zeros((size, self.width), dtype=np.int64)
+
+    def add_chunk(self, attempt_rows: Dict[int, int], scores: List[float],
+                  answers: List[tuple]) -> None:
+        """Fold one chunk of attempts into the running sums.
+
+        ``attempt_rows`` maps attempt id to matrix row, ``scores`` holds the
+        attempt scores in row order and ``answers`` is a list of
+        (attempt_id, question_id, selected_option_id, is_correct) tuples.
+        """
+        n_attempts = len(scores)
+        n_questions = len(self.question_ids)
+        if not n_attempts or not n_questions:
+            return
+
+        correct = np.zeros((n_attempts, n_questions), dtype=np.int8)
+        # Unanswered questions land in the last option column
+        selected = np.full((n_attempts, n_questions), self.width - 1, dtype=np.int64)
+
+        rows, cols, flags, picks = [], [], [], []
+        for attempt_id, question_id, selected_option_id, is_correct in answers:
+            col = self.columns.get(question_id)
+            if col is None:
+                continue
+            rows.append(attempt_rows[attempt_id])
+            cols.append(col)
+            flags.append(1 if is_correct else 0)
+            picks.append(self.option_index[col].get(selected_option_id, self.width - 1))
+
+        if rows:
+            correct[rows, cols] = flags
+            selected[rows, cols] = picks
+
+        score = np.asarray(scores, dtype=np.float64)
+        self.responses += n_attempts
+        self.correct += correct.sum(axis=0)
+        self.sum_score += score.sum()
+        self.sum_score_sq += np.dot(score, score)
+        self.sum_correct_score += score @ correct
+
+        flat = selected + np.arange(n_questions)[np.newaxis, :] * self.width
+        self.option_counts += np.bincount(
+            flat.ravel(), minlength=n_questions * self.width
+        ).reshape(n_questions, self.width)
+
+    def load_existing(self, rows) -> None:
+        """Seed the running sums from previously cached question_stats rows."""
+        for row in rows:
+            col = self.columns.get(row['question_id'])
+            if col is None:
+                continue
+            self.responses[col] += row['responses']
+            self.correct[col] += row['correct']
+            self.sum_score[col] += row['sum_score']
+            self.sum_score_sq[col] += row['sum_score_sq']
+            self.sum_correct_score[col] += row['sum_correct_score']
+            counts = json.loads(row['option_counts'] or '{}')
+            for opt_id, count in counts.items():
+                k = self.width - 1 if opt_id == UNANSWERED_KEY else self.option_index[col].get(opt_id)
+                if k is not None:
+                    self.option_counts[col, k] += count
+
+    def statistics(self):
+        """Return (p_value, point_biserial) arrays; NaN where undefined."""
+        n = self.responses.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p_value = self.correct / n
+            numerator = n * self.sum_correct_score - self.correct * self.sum_score
+            denominator = np.sqrt(
+                (n * self.correct - self.correct.astype(np.float64) ** 2)
+                * (n * self.sum_score_sq - self.sum_score ** 2)
+            )
+            point_biserial = numerator / denominator
+        point_biserial[~np.isfinite(point_biserial)] = np.nan
+        return p_value, point_biserial
+
+    def option_counts_json(self, col: int) -> str:
+        counts = {opt_id: int(self.option_counts[col, k])
+                  for k, opt_id in enumerate(self.option_ids[col])}
+        counts[UNANSWERED_KEY] = int(self.option_counts[col, self.width - 1])
+        return json.dumps(counts)
+
+
+def _nullable(value: float) -> Optional[float]:
+    return None if math.isnan(value) else float(value)
+
+
+def get_watermark(conn, job: str):
+    """Return (last_completed_at, last_attempt_id) for an incremental job."""
+    row = conn.execute(
+        'SELECT last_completed_at, last_attempt_id FROM job_watermarks WHERE job = ?',
+        (job,)
+    ).fetchone()
+    if not row:
+        return '', 0
+    return row['last_completed_at'] or '', row['last_attempt_id'] or 0
+
+
+def set_watermark(conn, job: str, completed_at, attempt_id: int) -> None:
+    conn.execute('''
+        INSERT INTO job_watermarks (job, last_completed_at, last_attempt_id, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(job) DO UPDATE SET
+            last_completed_at = excluded.last_completed_at,
+            last_attempt_id = excluded.last_attempt_id,
+            updated_at = excluded.updated_at
+    ''', (job, completed_at, attempt_id, datetime.now()))
+
+
+def iter_completed_attempt_chunks(conn, completed_at, attempt_id: int,
+                                  chunk_size: int = DEFAULT_CHUNK_SIZE, until=None):
+    """Yield lists of answer rows for completed attempts after a watermark.
+
+    Pages are keyset-paginated on (completed_at, id) and always contain whole
+    attempts, so memory stays bounded by ``chunk_size`` attempts. Attempts
+    completed at or after ``until`` are left for the next run.
+    """
+    while True:
+        rows = conn.execute('''
+            SELECT a.id AS attempt_id, a.quiz_id, a.score, a.completed_at,
+                   aa.question_id, aa.selected_option_id, aa.is_correct
+            FROM (
+                SELECT id, quiz_id, score, completed_at FROM attempts
+                WHERE completed_at IS NOT NULL
+                  AND (completed_at > ? OR (completed_at = ? AND id > ?))
+                  AND (? IS NULL OR completed_at < ?)
+                ORDER BY completed_at, id
+                LIMIT ?
+            ) a
+            LEFT JOIN attempt_answers aa ON aa.attempt_id = a.id
+            ORDER BY a.completed_at, a.id
+        ''', (completed_at, completed_at, attempt_id, until, until, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        completed_at, attempt_id = rows[-1]['completed_at'], rows[-1]['attempt_id']
+
+
+def refresh_question_stats(conn, shards: List, full: bool = False,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, int]:
+    """Fold attempts completed since the last run into question_stats.
+
+    ``conn`` holds the stats and the watermark; attempts are read from each
+    of ``shards``. With ``full=True`` the cache is dropped and rebuilt from
+    every completed attempt. Returns a summary with the number of attempts
+    and quizzes seen.
+    """
+    if full:
+        conn.execute('DELETE FROM question_stats')
+        conn.execute('DELETE FROM job_watermarks WHERE job = ?', (JOB_NAME,))
+
+    completed_at, attempt_id = get_watermark(conn, JOB_NAME)
+    # Shards are read one after another, so instead of the last attempt seen
+    # the new watermark is a horizon that every shard was read up to
+    horizon = str(datetime.now() - timedelta(seconds=WATERMARK_LAG_SECONDS))
+    accumulators: Dict[str, Optional[_QuizAccumulator]] = {}
+    seen_attempts = 0
+
+    chunks = ((shard, rows) for shard in shards
+              for rows in iter_completed_attempt_chunks(shard, completed_at, attempt_id,
+                                                        chunk_size, until=horizon))
+    for shard, rows in chunks:
+        by_quiz: Dict[str, tuple] = {}
+        attempt_quiz: Dict[int, str] = {}
+        without_rows = []
+        for row in rows:
+            attempt_rows, scores, answers = by_quiz.setdefault(row['quiz_id'], ({}, [], []))
+            if row['attempt_id'] not in attempt_rows:
+                attempt_rows[row['attempt_id']] = len(scores)
+                scores.append(row['score'] or 0)
+                attempt_quiz[row['attempt_id']] = row['quiz_id']
+            if row['question_id'] is not None:
+                answers.append((row['attempt_id'], row['question_id'],
+                                row['selected_option_id'], row['is_correct']))
+            else:
+                without_rows.append(row['attempt_id'])
+
+        # Archived attempts keep their answers in attempt_answer_packs
+        for packed_id, packed in load_packed_answers(shard, without_rows).items():
+            answers = by_quiz[attempt_quiz[packed_id]][2]
+            answers.extend((packed_id, qid, option_id, is_correct)
+                           for qid, (option_id, is_correct) in packed.items())
+
+        for quiz_id, (attempt_rows, scores, answers) in by_quiz.items():
+            seen_attempts += len(scores)
+            if quiz_id not in accumulators:
+                quiz = get_quiz_by_id(quiz_id)
+                accumulators[quiz_id] = _QuizAccumulator(quiz) if quiz else None
+            if accumulators[quiz_id] is not None:
+                accumulators[quiz_id].add_chunk(attempt_rows, scores, answers)
+
+    updated_at = datetime.now()
+    for quiz_id, acc in accumulators.items():
+        if acc is None:
+            continue
+        acc.load_existing(conn.execute(
+            'SELECT * FROM question_stats WHERE quiz_id = ?', (quiz_id,)
+        ).fetchall())
+        p_value, point_biserial = acc.statistics()
+        conn.executemany('''
+            INSERT OR REPLACE INTO question_stats (
+                quiz_id, question_id, responses, correct, sum_score, sum_score_sq,
+                sum_correct_score, option_counts, p_value, point_biserial, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (quiz_id, qid, int(acc.responses[col]), int(acc.correct[col]),
+             float(acc.sum_score[col]), float(acc.sum_score_sq[col]),
+             float(acc.sum_correct_score[col]), acc.option_counts_json(col),
+             _nullable(p_value[col]), _nullable(point_biserial[col]), updated_at)
+            for col, qid in enumerate(acc.question_ids)
+        ])
+
+    # (horizon, 0) resumes with attempts completed exactly at the horizon;
+    # never move the watermark backwards
+    if horizon > completed_at:
+        set_watermark(conn, JOB_NAME, horizon, 0)
+    conn.commit()
+
+    return {
+        'attempts': seen_attempts,
+        'quizzes': sum(1 for acc in accumulators.values() if acc is not None),
+    }
+
+
+def get_flagged_questions(conn, min_responses: int = MIN_RESPONSES_FOR_FLAG) -> List[Dict]:
+    """Return cached stats for questions that look too easy, too hard or non-discriminating."""
+    rows = conn.execute('''
+        SELECT quiz_id, question_id, responses, p_value, point_biserial, option_counts
+        FROM question_stats
+        WHERE responses >= ?
+          AND (p_value < ? OR p_value > ? OR point_biserial < ?)
+        ORDER BY quiz_id, question_id
+    ''', (min_responses, MIN_P_VALUE, MAX_P_VALUE, MIN_DISCRIMINATION)).fetchall()
+    return [dict(row) for row in rows]
@@ -0,0 +1,176 @@
+"""
+Leaderboard Module
+Maintains bounded top-K leaderboards per quiz and across all quizzes.
+
+Each scope keeps at most one entry per user (their best attempt), ranked by
+score and then by completion duration, so reading a board never touches the
+attempts table.
+
+With sharded storage every shard keeps the top K of its own users. Each user
+lives on exactly one shard, so the global top K is always among the union of
+the shard boards and a read merges K entries per shard.
+"""
+
+from typing import Dict, List, Optional
+
+GLOBAL_SCOPE = 'global'
+LEADERBOARD_SIZE = 50
+
+# Shared ranking: higher score first, then faster completion, then earlier finish
+RANK_ORDER = 'score DESC, duration_seconds ASC, completed_at ASC, attempt_id ASC'
+
+# Time an attempt took, over an ``attempts`` row. Attempts closed by the expiry
+# sweep end at their deadline, not at the later moment the sweep ran.
+DURATION_SQL = ('(julianday(MIN(COALESCE(expires_at, completed_at), completed_at))'
+                ' - julianday(started_at)) * 86400.0')
+
+
+def _ranks_above(score: int, duration_seconds: float, other) -> bool:
+    """True when (score, duration) strictly beats an existing entry."""
+    if score != other['score']:
+        return score > other['score']
+    return duration_seconds < other['duration_seconds']
+
+
+def _offer(c, scope: str, user_id: int, quiz_id: str, attempt_id: int, score: int,
+           duration_seconds: float, completed_at, size: int) -> bool:
+    c.execute('''
+        SELECT score, duration_seconds FROM leaderboard_entries
+        WHERE scope = ? AND user_id = ?
+    ''', (scope, user_id))
+    existing = c.fetchone()
+    if existing and not _ranks_above(score, duration_seconds, existing):
+        return False
+
+    if not existing:
+        # The K-th entry is the cut-off a newcomer has to beat
+        c.execute(f'''
+            SELECT score, duration_seconds FROM leaderboard_entries
+            WHERE scope = ?
+            ORDER BY {RANK_ORDER}
+            LIMIT 1 OFFSET ?
+        ''', (scope, size - 1))
+        cutoff = c.fetchone()
+        if cutoff and not _ranks_above(score, duration_seconds, cutoff):
+            return False
+
+    c.execute('''
+        INSERT INTO leaderboard_entries
+            (scope, user_id, attempt_id, quiz_id, score, duration_seconds, completed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(scope, user_id) DO UPDATE SET
+            attempt_id = excluded.attempt_id,
+            quiz_id = excluded.quiz_id,
+            score = excluded.score,
+            duration_seconds = excluded.duration_seconds,
+            completed_at = excluded.completed_at
+    ''', (scope, user_id, attempt_id, quiz_id, score, duration_seconds, completed_at))
+
+    if not existing:
+        c.execute(f'''
+            DELETE FROM leaderboard_entries
+            WHERE scope = ? AND user_id IN (
+                SELECT user_id FROM leaderboard_entries
+                WHERE scope = ?
+                ORDER BY {RANK_ORDER}
+                LIMIT -1 OFFSET ?
+            )
+        ''', (scope, scope, size))
+    return True
+
+
+def record_score(c, user_id: int, quiz_id: str, attempt_id: int, score: int,
+                 duration_seconds: float, completed_at,
+                 size: int = LEADERBOARD_SIZE) -> None:
+    """Offer a freshly completed attempt to its quiz board and the global board.
+
+    Runs on the caller's cursor so the update commits with the attempt itself.
+    """
+    for scope in (quiz_id, GLOBAL_SCOPE):
+        _offer(c, scope, user_id, quiz_id, attempt_id, score,
+               duration_seconds, completed_at, size)
+
+
+def _rank_key(entry: Dict) -> tuple:
+    """Python twin of RANK_ORDER for merging shard boards."""
+    return (-entry['score'], entry['duration_seconds'], entry['completed_at'] or '',
+            entry['attempt_id'])
+
+
+def get_leaderboard(shards, users_conn, scope: str = GLOBAL_SCOPE,
+                    limit: int = LEADERBOARD_SIZE) -> List[Dict]:
+    """Return the ranked entries of one board with user names attached.
+
+    ``shards`` are connections to every shard; user names come from
+    ``users_conn`` (the main database).
+    """
+    entries = []
+    for conn in shards:
+        entries.extend(dict(row) for row in conn.execute(f'''
+            SELECT * FROM leaderboard_entries
+            WHERE scope = ?
+            ORDER BY {RANK_ORDER}
+            LIMIT ?
+        ''', (scope, limit)).fetchall())
+    entries = sorted(entries, key=_rank_key)[:limit]
+
+    names = {}
+    user_ids = list({entry['user_id'] for entry in entries})
+    if user_ids:
+        names = dict(users_conn.execute(f'''
+            SELECT id, name FROM users WHERE id IN ({', '.join('?' for _ in user_ids)})
+        ''', user_ids).fetchall())
+    return [dict(entry, user_name=names.get(entry['user_id']), rank=i)
+            for i, entry in enumerate(entries, start=1)]
+
+
+def rebuild_leaderboards(conn, size: int = LEADERBOARD_SIZE,
+                         quiz_id: Optional[str] = None) -> int:
+    """Recompute boards from completed attempts; returns the number of entries written.
+
+    Passing ``quiz_id`` rebuilds only that quiz's board, otherwise every quiz
+    board and the global board are recomputed.
+    """
+    scope_filter = ''
+    params: list = []
+    if quiz_id:
+        scope_filter = 'WHERE scope = ?'
+        params.append(quiz_id)
+        conn.execute('DELETE FROM leaderboard_entries WHERE scope = ?', (quiz_id,))
+    else:
+        conn.execute('DELETE FROM leaderboard_entries')
+
+    cur = conn.execute(f'''
+        INSERT INTO leaderboard_entries
+            (scope, user_id, attempt_id, quiz_id, score, duration_seconds, completed_at)
+        WITH scored AS (
+            SELECT id AS attempt_id, user_id, quiz_id, score, completed_at,
+                   {DURATION_SQL} AS duration_seconds
+            FROM attempts
+            WHERE completed_at IS NOT NULL
+        ),
+        scoped AS (
+            SELECT quiz_id AS scope, * FROM scored
+            UNION ALL
+            SELECT '{GLOBAL_SCOPE}' AS scope, * FROM scored
+        ),
+        best_per_user AS (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY scope, user_id ORDER BY {RANK_ORDER}
+            ) AS user_rank
+            FROM scoped
+            {scope_filter}
+        ),
+        ranked AS (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY scope ORDER BY {RANK_ORDER}
+            ) AS board_rank
+            FROM best_per_user
+            WHERE user_rank = 1
+        )
+        SELECT scope, user_id, attempt_id, quiz_id, score, duration_seconds, completed_at
+        FROM ranked
+        WHERE board_rank <= ?
+    ''', (*params, size))
+    conn.commit()
+    return cur.rowcount
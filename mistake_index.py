@@ -0,0 +1,189 @@
+"""
+Mistake Index Module
+Per-user index of missed questions that drives review mode.
+
+Each row is one question a user got wrong, with a streak of correct answers
+since the last miss and the time it is next due. Rows are written when an
+attempt is graded (set-based over its answers) and when a review is answered,
+so the review page reads its next questions with one range scan on
+``(user_id, due_at)`` instead of re-grading the user's history.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+# Days until the next review after 1, 2, 3... correct answers in a row; one
+# more correct answer after the last step and the question counts as learned
+REVIEW_INTERVALS_DAYS = [1, 3, 7, 16]
+# A missed review comes back within the same session, but not immediately
+RELEARN_MINUTES = 10
+REVIEW_BATCH_SIZE = 10
+
+
+def _next_due_sql() -> str:
+    """SQL expression for the due time after a correct answer, given ``?`` = now."""
+    steps = ' '.join(f"WHEN {streak} THEN '+{days} days'"
+                     for streak, days in enumerate(REVIEW_INTERVALS_DAYS, start=1))
+    last = f"'+{REVIEW_INTERVALS_DAYS[-1]} days'"
+    return f"strftime('%Y-%m-%d %H:%M:%f', ?, CASE streak + 1 {steps} ELSE {last} END)"
+
+
+def _drop_learned(c, user_ids: Iterable[int]) -> None:
+    user_ids = list(user_ids)
+    placeholders = ', '.join('?' for _ in user_ids)
+    c.execute(f'''
+        DELETE FROM user_mistakes
+        WHERE user_id IN ({placeholders}) AND streak > ?
+    ''', (*user_ids, len(REVIEW_INTERVALS_DAYS)))
+
+
+def record_attempt_mistakes(c, attempt_ids: Iterable[int], now: datetime) -> None:
+    """Fold the graded answers of completed attempts into the index.
+
+    Correct answers to due questions advance their streak; wrong answers
+    (re)enter the index as due straight away. Runs on the caller's cursor so
+    it commits together with the grading.
+    """
+    attempt_ids = list(attempt_ids)
+    if not attempt_ids:
+        return
+    placeholders = ', '.join('?' for _ in attempt_ids)
+
+    c.execute(f'''
+        UPDATE user_mistakes
+        SET streak = streak + 1,
+            due_at = {_next_due_sql()}
+        FROM attempt_answers aa
+        JOIN attempts a ON a.id = aa.attempt_id
+        WHERE aa.attempt_id IN ({placeholders})
+          AND aa.is_correct = 1
+          AND user_mistakes.user_id = a.user_id
+          AND user_mistakes.quiz_id = a.quiz_id
+          AND user_mistakes.question_id = aa.question_id
+          AND user_mistakes.due_at <= ?
+    ''', (now, *attempt_ids, now))
+
+    # Misses are applied last so a question wrong anywhere in the batch stays due
+    c.execute(f'''
+        INSERT INTO user_mistakes (user_id, quiz_id, question_id, last_wrong_at, wrong_count, streak, due_at)
+        SELECT a.user_id, a.quiz_id, aa.question_id, ?, 1, 0, ?
+        FROM attempt_answers aa
+        JOIN attempts a ON a.id = aa.attempt_id
+        WHERE aa.attempt_id IN ({placeholders})
+          AND COALESCE(aa.selected_option_id, '') <> ''
+          AND aa.is_correct = 0
+        ON CONFLICT(user_id, quiz_id, question_id) DO UPDATE SET
+            last_wrong_at = excluded.last_wrong_at,
+            wrong_count = wrong_count + 1,
+            streak = 0,
+            due_at = excluded.due_at
+    ''', (now, now, *attempt_ids))
+
+    user_ids = [row[0] for row in c.execute(f'''
+        SELECT DISTINCT user_id FROM attempts WHERE id IN ({placeholders})
+    ''', attempt_ids).fetchall()]
+    _drop_learned(c, user_ids)
+
+
+def apply_regraded_answers(c, changes: Iterable[tuple], now: datetime) -> None:
+    """Carry re-graded answers of completed attempts over to the index.
+
+    ``changes`` holds (user_id, quiz_id, question_id, is_correct) per flipped
+    answer. Answers that became wrong enter the index as due now. Answers
+    that became correct take back the miss they recorded, and the row is
+    dropped once no misses are left.
+    """
+    misses: Dict[tuple, int] = {}
+    cleared: Dict[tuple, int] = {}
+    for user_id, quiz_id, question_id, is_correct in changes:
+        target = cleared if is_correct else misses
+        key = (user_id, quiz_id, question_id)
+        target[key] = target.get(key, 0) + 1
+
+    c.executemany('''
+        INSERT INTO user_mistakes (user_id, quiz_id, question_id, last_wrong_at, wrong_count, streak, due_at)
+        VALUES (?, ?, ?, ?, ?, 0, ?)
+        ON CONFLICT(user_id, quiz_id, question_id) DO UPDATE SET
+            last_wrong_at = excluded.last_wrong_at,
+            wrong_count = wrong_count + excluded.wrong_count,
+            streak = 0,
+            due_at = excluded.due_at
+    ''', [(*key, now, count, now) for key, count in misses.items()])
+    c.executemany('''
+        DELETE FROM user_mistakes
+        WHERE user_id = ? AND quiz_id = ? AND question_id = ? AND wrong_count <= ?
+    ''', [(*key, count) for key, count in cleared.items()])
+    c.executemany('''
+        UPDATE user_mistakes SET wrong_count = wrong_count - ?
+        WHERE user_id = ? AND quiz_id = ? AND question_id = ?
+    ''', [(count, *key) for key, count in cleared.items()])
+
+
+def record_review(c, user_id: int, quiz_id: str, question_id: int,
+                  is_correct: bool, now: datetime) -> bool:
+    """Apply one answer given in review mode to its index row.
+
+    Only a question that is due counts, so answering it again before its
+    next review (e.g. a resubmitted form) changes nothing. Returns whether
+    the answer was recorded.
+    """
+    if is_correct:
+        c.execute(f'''
+            UPDATE user_mistakes
+            SET streak = streak + 1,
+                due_at = {_next_due_sql()}
+            WHERE user_id = ? AND quiz_id = ? AND question_id = ? AND due_at <= ?
+        ''', (now, user_id, quiz_id, question_id, now))
+        recorded = c.rowcount > 0
+        _drop_learned(c, [user_id])
+    else:
+        c.execute('''
+            UPDATE user_mistakes
+            SET last_wrong_at = ?, wrong_count = wrong_count + 1, streak = 0, due_at = ?
+            WHERE user_id = ? AND quiz_id = ? AND question_id = ? AND due_at <= ?
+        ''', (now, now + timedelta(minutes=RELEARN_MINUTES), user_id, quiz_id, question_id, now))
+        recorded = c.rowcount > 0
+    return recorded
+
+
+def get_due_reviews(c, user_id: int, now: datetime,
+                    limit: int = REVIEW_BATCH_SIZE) -> List[Dict]:
+    """Return the user's due questions, longest-overdue first."""
+    c.execute('''
+        SELECT quiz_id, question_id, last_wrong_at, wrong_count, streak, due_at
+        FROM user_mistakes
+        WHERE user_id = ? AND due_at <= ?
+        ORDER BY due_at
+        LIMIT ?
+    ''', (user_id, now, limit))
+    return [dict(row) for row in c.fetchall()]
+
+
+def get_review_summary(c, user_id: int, now: datetime) -> Dict:
+    """Counts for the review page: due now, total tracked and the next due time."""
+    c.execute('''
+        SELECT COUNT(*) AS tracked,
+               COALESCE(SUM(due_at <= ?), 0) AS due,
+               MIN(CASE WHEN due_at > ? THEN due_at END) AS next_due_at
+        FROM user_mistakes
+        WHERE user_id = ?
+    ''', (now, now, user_id))
+    return dict(c.fetchone())
+
+
+def get_mistake(c, user_id: int, quiz_id: str, question_id: int) -> Optional[Dict]:
+    c.execute('''
+        SELECT quiz_id, question_id, last_wrong_at, wrong_count, streak, due_at
+        FROM user_mistakes
+        WHERE user_id = ? AND quiz_id = ? AND question_id = ?
+    ''', (user_id, quiz_id, question_id))
+    row = c.fetchone()
+    return dict(row) if row else None
+
+
+def forget_mistake(c, user_id: int, quiz_id: str, question_id: int) -> None:
+    """Drop a row whose question no longer exists in its bank."""
+    c.execute('''
+        DELETE FROM user_mistakes
+        WHERE user_id = ? AND quiz_id = ? AND question_id = ?
+    ''', (user_id, quiz_id, question_id))
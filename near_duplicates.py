@@ -0,0 +1,202 @@
+"""
+Near-Duplicate Question Module
+Finds questions that are worded almost the same, within and across banks.
+
+Each question (text plus its options, in any order) is cut into character
+shingles and summarised by a MinHash signature whose matching positions
+estimate the Jaccard similarity of two questions. Signatures are split into
+bands and hashed into buckets (LSH), so only questions sharing a bucket are
+compared and a run does not grow with the square of the corpus.
+
+Signatures are cached per bank in ``bank_signatures`` together with a hash
+of the bank's question texts; a run only re-signs banks whose texts changed
+and, unless asked for everything, only reports pairs touching those banks.
+"""
+
+import hashlib
+import json
+import re
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from data_loader import iter_banks
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+BANDS = 32
+ROWS_PER_BAND = NUM_PERM // BANDS
+DEFAULT_THRESHOLD = 0.8
+# Bump when the shingling or hashing changes so cached signatures are redone
+SIGNATURE_VERSION = 1
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20261019)
+_PERM_A = _rng.integers(1, _MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+
+QuestionKey = Tuple[str, int]
+
+
+def question_text(question: Dict) -> str:
+    """Normalised text of a question and its options; option order is ignored."""
+    options = sorted(opt.get('text', '') for opt in question.get('options', []))
+    text = ' | '.join([question.get('question_text', ''), *options])
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[int]:
+    """crc32 hashes of the overlapping ``size``-character slices of ``text``."""
+    if len(text) <= size:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {zlib.crc32(text[i:i + size].encode('utf-8')) for i in range(len(text) - size + 1)}
+
+
+def minhash(shingle_hashes: Set[int]) -> np.ndarray:
+    """MinHash signature of one shingle set under ``NUM_PERM`` universal hash functions."""
+    values = np.fromiter(shingle_hashes, dtype=np.uint64) % _MERSENNE_PRIME
+    # a < 2**31 and values < 2**31, so the products fit in 64 bits
+    hashed = (np.outer(values, _PERM_A) + _PERM_B) % _MERSENNE_PRIME
+    return hashed.min(axis=0).astype(np.uint32)
+
+
+def bank_content_hash(texts: List[Tuple[int, str]]) -> str:
+    canonical = json.dumps([SIGNATURE_VERSION, texts])
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def refresh_signatures(conn, banks: Dict[str, Dict]) -> Set[str]:
+    """Re-sign banks whose question texts changed; returns their quiz ids.
+
+    Banks no longer on disk are dropped from the cache. Nothing is committed,
+    so a caller can keep the old hashes when the new banks are rejected.
+    """
+    stored = dict(conn.execute('SELECT quiz_id, content_hash FROM bank_signatures').fetchall())
+    changed = set()
+    for quiz_id, quiz in banks.items():
+        texts = [(q['id'], question_text(q)) for q in quiz.get('questions', [])]
+        content_hash = bank_content_hash(texts)
+        if stored.get(quiz_id) == content_hash:
+            continue
+        signatures = np.array([minhash(shingles(text)) for _, text in texts],
+                              dtype=np.uint32).reshape(-1, NUM_PERM)
+        conn.execute('''
+            INSERT INTO bank_signatures (quiz_id, content_hash, question_ids, signatures, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(quiz_id) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                question_ids = excluded.question_ids,
+                signatures = excluded.signatures,
+                updated_at = excluded.updated_at
+        ''', (quiz_id, content_hash, json.dumps([qid for qid, _ in texts]),
+              signatures.tobytes(), datetime.now()))
+        changed.add(quiz_id)
+
+    for quiz_id in set(stored) - set(banks):
+        conn.execute('DELETE FROM bank_signatures WHERE quiz_id = ?', (quiz_id,))
+    return changed
+
+
+def load_signatures(conn) -> Tuple[List[QuestionKey], np.ndarray]:
+    """Return every cached question key and the matching signature matrix."""
+    keys: List[QuestionKey] = []
+    blocks = []
+    for quiz_id, question_ids, signatures in conn.execute('''
+        SELECT quiz_id, question_ids, signatures FROM bank_signatures ORDER BY quiz_id
+    ''').fetchall():
+        keys.extend((quiz_id, qid) for qid in json.loads(question_ids))
+        blocks.append(np.frombuffer(signatures, dtype=np.uint32).reshape(-1, NUM_PERM))
+    matrix = np.vstack(blocks) if blocks else np.zeros((0, NUM_PERM), dtype=np.uint32)
+    return keys, matrix
+
+
+def candidate_pairs(signatures: np.ndarray, focus: Optional[np.ndarray] = None) -> Set[Tuple[int, int]]:
+    """Row pairs that share at least one LSH band bucket.
+
+    With a boolean ``focus`` mask only pairs with a focused row are kept.
+    """
+    pairs: Set[Tuple[int, int]] = set()
+    for band in range(BANDS):
+        rows = np.ascontiguousarray(signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])
+        buckets: Dict[bytes, List[int]] = {}
+        for index, row in enumerate(rows):
+            buckets.setdefault(row.tobytes(), []).append(index)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    if focus is None or focus[first] or focus[second]:
+                        pairs.add((first, second))
+    return pairs
+
+
+def _clusters(pairs: List[Tuple[int, int, float]]) -> List[Dict]:
+    parent: Dict[int, int] = {}
+
+    def find(item: int) -> int:
+        parent.setdefault(item, item)
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    for first, second, _ in pairs:
+        parent[find(first)] = find(second)
+
+    grouped: Dict[int, Dict] = {}
+    for first, second, similarity in pairs:
+        cluster = grouped.setdefault(find(first), {'members': set(), 'pairs': []})
+        cluster['members'].update((first, second))
+        cluster['pairs'].append((first, second, similarity))
+    return list(grouped.values())
+
+
+def find_near_duplicates(conn, threshold: float = DEFAULT_THRESHOLD,
+                         full: bool = False) -> Dict:
+    """Refresh signatures and group questions whose estimated similarity reaches ``threshold``.
+
+    Only pairs involving a changed bank are reported unless ``full`` is set.
+    Returns the changed banks, counts, and clusters sorted by their highest
+    similarity; each cluster lists its (quiz_id, question_id) members, their
+    texts and the scored pairs. The caller commits the refreshed signatures.
+    """
+    banks = dict(iter_banks())
+    changed = refresh_signatures(conn, banks)
+    keys, signatures = load_signatures(conn)
+
+    focus = None
+    if not full:
+        focus = np.array([quiz_id in changed for quiz_id, _ in keys], dtype=bool)
+    candidates = candidate_pairs(signatures, focus) if full or changed else set()
+
+    scored = []
+    for first, second in candidates:
+        similarity = float(np.mean(signatures[first] == signatures[second]))
+        if similarity >= threshold:
+            scored.append((first, second, similarity))
+
+    texts = {(quiz_id, q['id']): q.get('question_text', '')
+             for quiz_id, quiz in banks.items() for q in quiz.get('questions', [])}
+    clusters = []
+    for cluster in _clusters(scored):
+        members = sorted(keys[i] for i in cluster['members'])
+        pairs = sorted(((keys[a], keys[b], similarity) for a, b, similarity in cluster['pairs']),
+                       key=lambda pair: -pair[2])
+        clusters.append({
+            'members': [(key, texts.get(key, '')) for key in members],
+            'pairs': pairs,
+            'max_similarity': pairs[0][2],
+        })
+    clusters.sort(key=lambda cluster: -cluster['max_similarity'])
+
+    return {
+        'banks': len(banks),
+        'changed': sorted(changed),
+        'questions': len(keys),
+        'candidates': len(candidates),
+        'pairs': len(scored),
+        'clusters': clusters,
+    }
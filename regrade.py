@@ -0,0 +1,245 @@
+"""
+Re-grading Module
+Carries answer-key corrections in the question banks over to graded history.
+
+The answer key of every bank (question id -> correct option) is hashed and
+stored in ``bank_answer_keys``. A run compares each bank's current hash with
+the stored one; only banks whose key changed are diffed question by question,
+and only the answers to changed questions are re-graded.
+
+Work is done in batches of attempts, each in its own short transaction:
+changed answers are collected into a temp table with one set-based query,
+written back to ``attempt_answers`` (or the attempt's packed row), and the
+per-attempt deltas are applied to the ``attempts`` totals in one UPDATE.
+The review index (``user_mistakes``) follows the flipped answers of
+submitted attempts in the same transaction.
+
+A bank's new hash is stored only after all its batches are committed on
+every shard, so an interrupted run simply picks up the same diff next time.
+"""
+
+import hashlib
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from answer_store import pack_answers, unpack_answers
+from data_loader import iter_banks
+from mistake_index import apply_regraded_answers
+
+DEFAULT_BATCH_SIZE = 500
+
+AnswerKey = Dict[int, Optional[str]]
+
+
+def bank_answer_key(quiz: Dict) -> AnswerKey:
+    """Map each question id to the option graded as correct (None if there is none)."""
+    key = {}
+    for question in quiz.get('questions', []):
+        key[question['id']] = next(
+            (opt['id'] for opt in question.get('options', []) if opt.get('is_correct')), None)
+    return key
+
+
+def answer_key_hash(key: AnswerKey) -> str:
+    canonical = json.dumps({str(qid): option for qid, option in key.items()}, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def changed_questions(conn, quiz_id: str, key: AnswerKey) -> Optional[AnswerKey]:
+    """Return the part of ``key`` that differs from the stored key, or None if unchanged.
+
+    A bank seen for the first time returns its whole key, so its history is
+    checked once against the current banks.
+    """
+    row = conn.execute('''
+        SELECT key_hash, answer_key FROM bank_answer_keys WHERE quiz_id = ?
+    ''', (quiz_id,)).fetchone()
+    if row is None:
+        return dict(key)
+    if row[0] == answer_key_hash(key):
+        return None
+    old = {int(qid): option for qid, option in json.loads(row[1]).items()}
+    return {qid: option for qid, option in key.items() if old.get(qid, option) != option}
+
+
+def store_answer_key(conn, quiz_id: str, key: AnswerKey) -> None:
+    conn.execute('''
+        INSERT INTO bank_answer_keys (quiz_id, key_hash, answer_key, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(quiz_id) DO UPDATE SET
+            key_hash = excluded.key_hash,
+            answer_key = excluded.answer_key,
+            updated_at = excluded.updated_at
+    ''', (quiz_id, answer_key_hash(key),
+          json.dumps({str(qid): option for qid, option in key.items()}, sort_keys=True),
+          datetime.now()))
+    conn.commit()
+
+
+def _collect_pack_changes(conn, attempt_ids: List[int], changed: AnswerKey) -> int:
+    """Re-grade packed answers of a batch in Python; returns packs rewritten."""
+    placeholders = ', '.join('?' for _ in attempt_ids)
+    packs = conn.execute(f'''
+        SELECT attempt_id, selected, correct FROM attempt_answer_packs
+        WHERE attempt_id IN ({placeholders})
+    ''', attempt_ids).fetchall()
+    if not packs:
+        return 0
+
+    # An answer row shadows the packed answer for the same question
+    shadowed = set(conn.execute(f'''
+        SELECT attempt_id, question_id FROM attempt_answers
+        WHERE attempt_id IN ({placeholders})
+    ''', attempt_ids).fetchall())
+
+    rewritten = 0
+    for attempt_id, selected, correct in packs:
+        answers = unpack_answers(selected, correct)
+        deltas = []
+        for question_id, (option_id, is_correct) in answers.items():
+            if question_id not in changed or (attempt_id, question_id) in shadowed:
+                continue
+            new_correct = 1 if option_id == changed[question_id] else 0
+            if new_correct != is_correct:
+                answers[question_id] = (option_id, new_correct)
+                deltas.append((None, attempt_id, question_id, new_correct))
+        if deltas:
+            packed = pack_answers(answers)
+            conn.execute('''
+                UPDATE attempt_answer_packs SET correct = ? WHERE attempt_id = ?
+            ''', (packed[1], attempt_id))
+            conn.executemany('''
+                INSERT INTO regrade_changes (answer_id, attempt_id, question_id, is_correct)
+                VALUES (?, ?, ?, ?)
+            ''', deltas)
+            rewritten += 1
+    return rewritten
+
+
+def _regrade_batch(conn, attempt_ids: List[int], changed: AnswerKey) -> Tuple[int, int]:
+    """Re-grade one batch of attempts in a single transaction.
+
+    Returns (answers flipped, completed attempts whose totals changed).
+    """
+    placeholders = ', '.join('?' for _ in attempt_ids)
+    key_rows = list(changed.items())
+    conn.execute('DELETE FROM regrade_changes')
+
+    conn.execute(f'''
+        INSERT INTO regrade_changes (answer_id, attempt_id, question_id, is_correct)
+        WITH answer_key (question_id, correct_option_id) AS (
+            VALUES {', '.join('(?, ?)' for _ in key_rows)}
+        )
+        SELECT aa.id, aa.attempt_id, aa.question_id, COALESCE(aa.selected_option_id = k.correct_option_id, 0)
+        FROM attempt_answers aa
+        JOIN answer_key k ON k.question_id = aa.question_id
+        WHERE aa.attempt_id IN ({placeholders})
+          AND COALESCE(aa.selected_option_id, '') <> ''
+          AND aa.is_correct <> COALESCE(aa.selected_option_id = k.correct_option_id, 0)
+    ''', (*[value for pair in key_rows for value in pair], *attempt_ids))
+
+    conn.execute('''
+        UPDATE attempt_answers
+        SET is_correct = r.is_correct
+        FROM regrade_changes r
+        WHERE r.answer_id IS NOT NULL AND attempt_answers.id = r.answer_id
+    ''')
+    _collect_pack_changes(conn, attempt_ids, changed)
+
+    flipped = conn.execute('SELECT COUNT(*) FROM regrade_changes').fetchone()[0]
+
+    # Only submitted attempts carry totals and review entries; open ones are
+    # graded on submit. Flips that cancel out leave an attempt's score as is.
+    changed_attempts = conn.execute('''
+        SELECT COUNT(*) FROM (
+            SELECT r.attempt_id
+            FROM regrade_changes r
+            JOIN attempts a ON a.id = r.attempt_id
+            WHERE a.completed_at IS NOT NULL
+            GROUP BY r.attempt_id
+            HAVING SUM(CASE WHEN r.is_correct = 1 THEN 1 ELSE -1 END) <> 0
+        )
+    ''').fetchone()[0]
+    apply_regraded_answers(conn, conn.execute('''
+        SELECT a.user_id, a.quiz_id, r.question_id, r.is_correct
+        FROM regrade_changes r
+        JOIN attempts a ON a.id = r.attempt_id
+        WHERE a.completed_at IS NOT NULL
+    ''').fetchall(), datetime.now())
+    conn.execute('''
+        WITH deltas AS (
+            SELECT attempt_id, SUM(CASE WHEN is_correct = 1 THEN 1 ELSE -1 END) AS delta
+            FROM regrade_changes
+            GROUP BY attempt_id
+        )
+        UPDATE attempts
+        SET score = score + d.delta,
+            total_correct = total_correct + d.delta,
+            total_wrong = total_wrong - d.delta
+        FROM deltas d
+        WHERE attempts.id = d.attempt_id AND attempts.completed_at IS NOT NULL
+    ''')
+    return flipped, changed_attempts
+
+
+def regrade_bank(conn, quiz_id: str, changed: AnswerKey,
+                 batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False) -> Dict[str, int]:
+    """Re-grade every attempt of one quiz against the changed part of its key."""
+    conn.execute('''CREATE TEMP TABLE IF NOT EXISTS regrade_changes (
+        answer_id INTEGER,
+        attempt_id INTEGER NOT NULL,
+        question_id INTEGER NOT NULL,
+        is_correct INTEGER NOT NULL
+    )''')
+    totals = {'attempts_scanned': 0, 'answers_changed': 0, 'attempts_changed': 0}
+    last_id = 0
+    while True:
+        attempt_ids = [row[0] for row in conn.execute('''
+            SELECT id FROM attempts
+            WHERE quiz_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (quiz_id, last_id, batch_size)).fetchall()]
+        if not attempt_ids:
+            return totals
+        last_id = attempt_ids[-1]
+
+        flipped, attempts_changed = _regrade_batch(conn, attempt_ids, changed)
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+        totals['attempts_scanned'] += len(attempt_ids)
+        totals['answers_changed'] += flipped
+        totals['attempts_changed'] += attempts_changed
+
+
+def regrade_all(conn, shards: List, quiz_id: Optional[str] = None,
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                dry_run: bool = False) -> Dict[str, Dict[str, int]]:
+    """Re-grade history for every bank whose answer key changed since the last run.
+
+    ``conn`` holds the stored answer keys; attempts are re-graded on each of
+    ``shards``. Returns per-quiz counts for the banks that were re-graded.
+    Leaderboards and question stats are left to the caller to refresh.
+    """
+    results = {}
+    for bank_id, quiz in iter_banks():
+        if quiz_id and bank_id != quiz_id:
+            continue
+        key = bank_answer_key(quiz)
+        changed = changed_questions(conn, bank_id, key)
+        if changed is None:
+            continue
+        counts = {'attempts_scanned': 0, 'answers_changed': 0, 'attempts_changed': 0}
+        if changed:
+            for shard in shards:
+                for name, value in regrade_bank(shard, bank_id, changed, batch_size,
+                                                dry_run).items():
+                    counts[name] += value
+        counts['questions_changed'] = len(changed)
+        results[bank_id] = counts
+        if not dry_run:
+            store_answer_key(conn, bank_id, key)
+    return results
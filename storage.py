@@ -0,0 +1,280 @@
+"""
+Sharded Storage Module
+Routes per-user tables to one of N SQLite files by a hash of the user id.
+
+The main database (``DATABASE``) keeps users and the tables shared by
+everyone. Attempts, their answers (rows and packs), coding submissions, the
+review index and the per-shard leaderboards live in shard files, so answer
+writes of users on different shards no longer queue behind one write lock.
+
+The layout is recorded in the main database's ``shards`` table. When it is
+empty the main database is the only shard, which is how a fresh or
+unresharded install runs. ``flask reshard`` moves rows into a new layout.
+
+Every shard hands out AUTOINCREMENT ids from its own range of
+``2 ** ID_RANGE_BITS`` values, so attempt and answer ids stay unique across
+shards and survive being moved by a reshard.
+"""
+
+import os
+import sqlite3
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from leaderboard import rebuild_leaderboards
+
+ID_RANGE_BITS = 40
+AUTOINCREMENT_TABLES = ['attempts', 'attempt_answers', 'coding_submissions']
+DEFAULT_COPY_BATCH_SIZE = 2000
+
+# (table, key column, user id expression) in copy order; leaderboards are
+# derived data and get rebuilt on the new shards instead of copied
+COPY_SPECS = [
+    ('attempts', 'id', 't.user_id', 'attempts t'),
+    ('attempt_answers', 'id', 'a.user_id',
+     'attempt_answers t LEFT JOIN attempts a ON a.id = t.attempt_id'),
+    ('attempt_answer_packs', 'attempt_id', 'a.user_id',
+     'attempt_answer_packs t LEFT JOIN attempts a ON a.id = t.attempt_id'),
+    ('coding_submissions', 'id', 't.user_id', 'coding_submissions t'),
+    ('user_mistakes', 'rowid', 't.user_id', 'user_mistakes t'),
+    # Import id map; looked up on every shard, so it is kept on the first one
+    ('imported_ids', 'rowid', 'NULL', 'imported_ids t'),
+]
+SHARDED_TABLES = [spec[0] for spec in COPY_SPECS] + ['leaderboard_entries']
+
+
+def shard_for_user(user_id: Optional[int], shard_count: int) -> int:
+    """Stable shard number for a user (crc32, so it is the same in every process)."""
+    if user_id is None or shard_count <= 1:
+        return 0
+    return zlib.crc32(str(user_id).encode('ascii')) % shard_count
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class ShardRouter:
+    def __init__(self, main_path: Callable[[], str]):
+        # Resolved on use, so pointing the app at another database (tests,
+        # benchmarks) also moves the shards
+        self._main_path = main_path
+        self._layout: Optional[List[Tuple[str, int]]] = None
+        self._layout_path: Optional[str] = None
+
+    @property
+    def main_path(self) -> str:
+        return self._main_path()
+
+    def _load_layout(self, main_path: str) -> List[Tuple[str, int]]:
+        conn = sqlite3.connect(main_path)
+        try:
+            rows = conn.execute('''
+                SELECT path, id_base FROM shards ORDER BY shard_index
+            ''').fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        finally:
+            conn.close()
+        if not rows:
+            return [(main_path, 0)]
+        base_dir = os.path.dirname(main_path)
+        return [(os.path.join(base_dir, path), id_base) for path, id_base in rows]
+
+    @property
+    def layout(self) -> List[Tuple[str, int]]:
+        """[(path, id_base)] per shard, read from the main database once per path."""
+        main_path = self.main_path
+        if self._layout is None or self._layout_path != main_path:
+            self._layout = self._load_layout(main_path)
+            self._layout_path = main_path
+        return self._layout
+
+    def reload(self) -> None:
+        self._layout = None
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.layout)
+
+    def shard_path(self, index: int) -> str:
+        return self.layout[index][0]
+
+    def shard_for_user(self, user_id: Optional[int]) -> int:
+        return shard_for_user(user_id, self.shard_count)
+
+    def connect_main(self) -> sqlite3.Connection:
+        return _connect(self.main_path)
+
+    def connect_shard(self, index: int) -> sqlite3.Connection:
+        return _connect(self.shard_path(index))
+
+    def connect_for_user(self, user_id: Optional[int]) -> sqlite3.Connection:
+        return self.connect_shard(self.shard_for_user(user_id))
+
+    def connect_all(self) -> List[sqlite3.Connection]:
+        """One new connection per shard, for fan-out queries and batch jobs."""
+        return [self.connect_shard(index) for index in range(self.shard_count)]
+
+    def init_shards(self, init_schema: Callable) -> None:
+        """Create the shard tables in every shard file and claim each shard's id range."""
+        for path, id_base in self.layout:
+            conn = sqlite3.connect(path)
+            init_schema(conn.cursor())
+            seed_id_range(conn, id_base)
+            conn.commit()
+            conn.close()
+
+
+def close_all(conns) -> None:
+    for conn in conns:
+        conn.close()
+
+
+def seed_id_range(conn, id_base: int) -> None:
+    """Start AUTOINCREMENT ids at ``id_base`` unless the shard already handed out higher ones."""
+    if not id_base:
+        return
+    for table in AUTOINCREMENT_TABLES:
+        row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        if row is None:
+            conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, id_base))
+        elif row[0] < id_base:
+            conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (id_base, table))
+
+
+def _highest_id(conns) -> int:
+    highest = 0
+    for conn in conns:
+        for table in AUTOINCREMENT_TABLES:
+            row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+            max_id = conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0]
+            highest = max(highest, row[0] if row else 0, max_id or 0)
+    return highest
+
+
+def shard_filename(main_path: str, index: int, shard_count: int) -> str:
+    stem, ext = os.path.splitext(os.path.basename(main_path))
+    return f'{stem}.shard{index}of{shard_count}{ext or ".db"}'
+
+
+def _copy_table(source, targets, shard_count: int, table: str, key: str,
+                user_expr: str, source_sql: str, batch_size: int) -> int:
+    copied = 0
+    last_key = None
+    while True:
+        where = '' if last_key is None else f'WHERE t.{key} > ?'
+        rows = source.execute(f'''
+            SELECT t.{key} AS copy_key, {user_expr} AS route_user, t.*
+            FROM {source_sql}
+            {where}
+            ORDER BY t.{key}
+            LIMIT ?
+        ''', ((last_key, batch_size) if last_key is not None else (batch_size,))).fetchall()
+        if not rows:
+            return copied
+
+        columns = [col for col in rows[0].keys() if col not in ('copy_key', 'route_user')]
+        insert = f'''
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES ({', '.join('?' for _ in columns)})
+        '''
+        batches: Dict[int, list] = {}
+        for row in rows:
+            # Orphaned rows (no owning attempt) are kept on shard 0
+            index = shard_for_user(row['route_user'], shard_count)
+            batches.setdefault(index, []).append(tuple(row[col] for col in columns))
+        for index, values in batches.items():
+            targets[index].executemany(insert, values)
+            targets[index].commit()
+        copied += len(rows)
+        last_key = rows[-1]['copy_key']
+
+
+def reshard(router: ShardRouter, shard_count: int, init_schema: Callable,
+            batch_size: int = DEFAULT_COPY_BATCH_SIZE, drop_source: bool = False) -> Dict:
+    """Copy every sharded table into ``shard_count`` new shard files and switch to them.
+
+    The app must be stopped while this runs. Row counts are checked before
+    the new layout is recorded; on any failure the new files are removed and
+    the old layout stays active. Old shard files (or, when leaving the
+    single-file layout, the sharded tables in the main database) are only
+    removed with ``drop_source``. Returns per-table row counts and the new paths.
+    """
+    if shard_count < 1:
+        raise ValueError('shard count must be at least 1')
+    old_layout = list(router.layout)
+    base_dir = os.path.dirname(router.main_path)
+    names = [shard_filename(router.main_path, i, shard_count) for i in range(shard_count)]
+    paths = [os.path.join(base_dir, name) for name in names]
+    if any(os.path.abspath(path) in {os.path.abspath(p) for p, _ in old_layout} for path in paths):
+        raise ValueError(f'Data is already stored in {shard_count} shards')
+    for path in paths:
+        # Leftovers of an interrupted run
+        if os.path.exists(path):
+            os.remove(path)
+
+    sources = [_connect(path) for path, _ in old_layout]
+    targets = [_connect(path) for path in paths]
+    try:
+        for target in targets:
+            init_schema(target.cursor())
+            target.commit()
+
+        counts = {}
+        for table, key, user_expr, source_sql in COPY_SPECS:
+            counts[table] = 0
+            for source in sources:
+                counts[table] += _copy_table(source, targets, shard_count, table, key,
+                                             user_expr, source_sql, batch_size)
+
+        for table in counts:
+            expected = sum(source.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                           for source in sources)
+            if expected != counts[table] or counts[table] != sum(
+                    target.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for target in targets):
+                raise RuntimeError(f'Row count mismatch while copying {table}')
+
+        # Fresh id ranges above everything ever handed out, old layout included
+        first_range = (_highest_id(sources + targets) >> ID_RANGE_BITS) + 1
+        id_bases = [(first_range + i) << ID_RANGE_BITS for i in range(shard_count)]
+        for target, id_base in zip(targets, id_bases):
+            seed_id_range(target, id_base)
+            target.commit()
+            rebuild_leaderboards(target)
+    except Exception:
+        close_all(targets)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        close_all(sources)
+
+    close_all(targets)
+    main = sqlite3.connect(router.main_path)
+    main.execute('DELETE FROM shards')
+    main.executemany('''
+        INSERT INTO shards (shard_index, path, id_base) VALUES (?, ?, ?)
+    ''', [(i, name, id_base) for i, (name, id_base) in enumerate(zip(names, id_bases))])
+    main.commit()
+
+    dropped = []
+    if drop_source:
+        for path, _ in old_layout:
+            if os.path.abspath(path) == os.path.abspath(router.main_path):
+                for table in SHARDED_TABLES:
+                    main.execute(f'DROP TABLE IF EXISTS {table}')
+                main.commit()
+                main.execute('VACUUM')
+            else:
+                os.remove(path)
+            dropped.append(path)
+    main.close()
+    router.reload()
+
+    return {'counts': counts, 'paths': paths,
+            'old_paths': [path for path, _ in old_layout], 'dropped': dropped}